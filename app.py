@@ -19,20 +19,23 @@ Please check the README for manual download options.""")
 import frontend
 import backend
 import crud_functionality as crud
+import migrations
 
 if __name__ == "__main__":
+    # Apply any pending schema migrations i.e. new indexes
+    migrations.run_migrations("ecommerce")
     _, date_created = backend.get_recent_backup("ecommerce")
     # If backup has not been created for the day
     if date_created != datetime.now().strftime("%d-%m-%y"):
         backend.backup("ecommerce")
     # Create placeholder image if it doesn't yet exist
     backend.create_placeholder()
-    # Configure encryption
-    admin_account = crud.search_table("ecommerce", "Staff", "*", "staff_id = '1'")[0]
-    if backend.get_should_encrypt() and admin_account.get("username")[0] == "|":
-        backend.encrypt_all()
-    elif not backend.get_should_encrypt() and admin_account.get("username")[0] == "^":
-        backend.decrypt_all()
-    # Create application and display
+    # Start sending any receipts that are waiting
+    backend.get_job_queue().start()
+    # Create application and display (encryption is configured whilst the loading message is shown)
     application = frontend.RootWindow()
     application.mainloop()
+    backend.get_job_queue().stop()
+    backend.outbox.stop()
+    # Release all pooled database connections on shutdown
+    crud.close_all_connections()
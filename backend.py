@@ -1,11 +1,18 @@
 # Built-in libraries
-import socket
-import timeit
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from email.message import EmailMessage
+import mimetypes
+import smtplib
 from datetime import datetime, timedelta
+import hashlib
+import hmac
 import math
 from matplotlib.figure import Figure
 from mpl_toolkits.axisartist.axislines import Subplot
 import os
+import threading
+import time
 from PIL import ImageTk, Image, ImageDraw, ImageFont
 import textwrap
 
@@ -17,6 +24,7 @@ import yagmail
 # Custom libraries
 import backend
 import crud_functionality as crud
+import jobs
 import utilities as util
 import validation
 
@@ -24,47 +32,70 @@ import validation
 colours = util.Colours()
 
 
-def get_should_encrypt():
-    with open("encryption_status.txt", "r") as encryption_config:
-        try:
-            if encryption_config.readline()[0] == "1":
-                return True
-            else:
-                return False
-        except TypeError:
-            raise Exception("""APPLICATION STOPPED: Encryption status has not been setup right.
-            Please check the README for encryption setup.""")
-
-
-def update_product_rating(product_id: int):
+class EncryptionConfig:
     """
-    Update the average rating for a product
+    Data structure that holds whether fields should be encrypted, so that the encryption status
+    file is only read again when it has been modified rather than on every encrypt or decrypt
 
     Parameters
     ----------
-    product_id : int
-        The id of the product to get the average rating for
-    """
-    # Get the scores of all the ratings related to the product
-    ratings = crud.search_table("ecommerce",
-                                "Ratings",
-                                ["score"],
-                                f"product_id = '{product_id}'")
-    scores = [rating.get("score") for rating in ratings]
-    if len(scores) == 0:
-        crud.update_record("ecommerce", "Product", {"average_rating": 0}, f"product_id = '{product_id}'")
-    else:
-        total = sum(scores)
-        # Calculate the average (amount / count)
-        crud.update_record("ecommerce",
-                           "Product",
-                           {"average_rating": round(total / len(scores), 1)},
-                           f"product_id = '{product_id}'")
+    file_name : str
+        The name of the encryption status file.
+        Defaults to "encryption_status.txt"
+
+    check_interval : float
+        The minimum number of seconds between checks for the file being modified.
+        Defaults to 1
+    """
+    def __init__(self,
+                 file_name: str = "encryption_status.txt",
+                 check_interval: float = 1):
+        self.file_name = file_name
+        self.check_interval = check_interval
+        self.should_encrypt = None
+        self.modified_time = None
+        self.last_checked = None
+
+    def load(self):
+        """
+        Reads the encryption status file
+        """
+        with open(self.file_name, "r") as encryption_config:
+            try:
+                self.should_encrypt = encryption_config.readline()[0] == "1"
+            except (IndexError, TypeError):
+                raise Exception("""APPLICATION STOPPED: Encryption status has not been setup right.
+                Please check the README for encryption setup.""")
+
+    def get_should_encrypt(self):
+        """
+        Gets whether fields should be encrypted, reloading the file if it has been modified since it was last read
+
+        Returns
+        -------
+        bool
+            True if fields should be encrypted
+        """
+        current_time = time.monotonic()
+        if self.last_checked is None or current_time - self.last_checked >= self.check_interval:
+            self.last_checked = current_time
+            modified_time = os.stat(self.file_name).st_mtime
+            if modified_time != self.modified_time:
+                self.load()
+                self.modified_time = modified_time
+        return self.should_encrypt
+
+
+encryption_config = EncryptionConfig()
+
+
+def get_should_encrypt():
+    return encryption_config.get_should_encrypt()
 
 
 def count_ratings(product_id: int):
     """
-    Count the number of ratings that exist for a product
+    Count the number of ratings that exist for a product, which is kept up to date by triggers on Ratings
 
     Parameters
     ----------
@@ -76,11 +107,10 @@ def count_ratings(product_id: int):
     int
         The total number of ratings that exist
     """
-    ratings = crud.search_table("ecommerce",
-                                "Ratings",
-                                ["score"],
-                                f"product_id = '{product_id}'")
-    return len(ratings)
+    return crud.search_table("ecommerce",
+                             "Product",
+                             ["rating_count"],
+                             {"product_id": product_id})[0].get("rating_count")
 
 
 def calculate_subtotal(basket: list):
@@ -544,14 +574,14 @@ def create_receipt(order_id: int,
                                      "Orders",
                                      [["Payment_Card", "payment_card_id"]],
                                      ["*"],
-                                     f"order_id='{order_id}'")[0]
+                                     {"order_id": order_id})[0]
     products_in_order = crud.search_joined_table("ecommerce",
                                                  "Order_Product",
                                                  [["Product", "product_id"]],
                                                  ["name",
                                                   "sale_price",
                                                   "quantity"],
-                                                 f"order_id = '{order_id}'")
+                                                 {"order_id": order_id})
                                           
     # Display customer information
     pdf.set_xy(10, header_h+15)
@@ -690,20 +720,44 @@ def get_total_sold(product_id: int, days_considered: int):
     end_of_timeframe = datetime.today()
     start_of_timeframe = datetime.today() - timedelta(days=days_considered)
 
-    # Calculate sales data between timeframe
-    orders = crud.search_table("ecommerce",
-                               "Orders",
-                               ["*"],
-                               f"date >= '{start_of_timeframe.strftime('%Y-%m-%d')}' AND date <= '{end_of_timeframe.strftime('%Y-%m-%d')}'")
-    order_ids = [f"'{order.get('order_id')}'" for order in orders]
-    formatted_order_ids = ", ".join(order_ids)
+    # Tally the units sold in orders made between the timeframe
+    total_sold = crud.aggregate("ecommerce",
+                                "Order_Product",
+                                {"Order_Product.quantity": "sum"},
+                                {"Order_Product.product_id": product_id,
+                                 "Orders.date": {">=": start_of_timeframe.strftime('%Y-%m-%d'),
+                                                 "<=": end_of_timeframe.strftime('%Y-%m-%d')}},
+                                table_and_links=[["Orders", "order_id"]])
+    # The sum is None if the product was not sold
+    return total_sold or 0
 
-    orders_with_product = crud.search_table("ecommerce",
-                                            "Order_Product",
-                                            ["*"],
-                                            f"order_id in ({formatted_order_ids}) AND product_id = '{product_id}'")
-    # Tally all the units sold for each order
-    return sum([order_with_product.get("quantity") for order_with_product in orders_with_product])
+
+def get_total_sold_per_product(days_considered: int):
+    """
+    Get the total units sold for every product over a past number of days
+
+    Parameters
+    ----------
+    days_considered : int
+        The number of past days the data should be from
+
+    Returns
+    -------
+    dict
+        Keys state the product ID.
+        Values state the total units sold. Products that were not sold are not included
+    """
+    # Calculate timeframe
+    end_of_timeframe = datetime.today()
+    start_of_timeframe = datetime.today() - timedelta(days=days_considered)
+
+    return crud.aggregate("ecommerce",
+                          "Order_Product",
+                          {"Order_Product.quantity": "sum"},
+                          {"Orders.date": {">=": start_of_timeframe.strftime('%Y-%m-%d'),
+                                           "<=": end_of_timeframe.strftime('%Y-%m-%d')}},
+                          group_by="Order_Product.product_id",
+                          table_and_links=[["Orders", "order_id"]])
 
 
 def create_product_summary(product_id: int, days_back: int):
@@ -730,7 +784,7 @@ def create_product_summary(product_id: int, days_back: int):
     product = crud.search_table("ecommerce",
                                 "Product",
                                 ["*"],
-                                f"product_id = '{product_id}'")[0]
+                                {"product_id": product_id})[0]
 
     # Calculate timeframe
     end_of_timeframe = datetime.today()
@@ -817,17 +871,19 @@ def create_product_summary(product_id: int, days_back: int):
             value_to_display = str(value)
         pdf.cell(w=column_width, h=row_height, txt=value_to_display, border=1, align="C")
 
-    # Get rating data
-    ratings = crud.search_table("ecommerce",
-                                "Ratings",
-                                ["*"],
-                                f"product_id = {product_id} AND date >= '{start_of_timeframe.strftime('%Y-%m-%d')}' AND date <= '{end_of_timeframe.strftime('%Y-%m-%d')}'")
-    scores = [rating.get("score") for rating in ratings]
-    scores_grouped = {f"{count} star": scores.count(count) for count in range(1, 6)}
-    num_of_ratings = len(scores)
+    # Get rating data, counting each score within the timeframe in one grouped query
+    ratings_per_score = crud.aggregate("ecommerce",
+                                       "Ratings",
+                                       {"*": "count"},
+                                       {"product_id": product_id,
+                                        "date": {">=": start_of_timeframe.strftime('%Y-%m-%d'),
+                                                 "<=": end_of_timeframe.strftime('%Y-%m-%d')}},
+                                       group_by="score")
+    scores_grouped = {f"{count} star": ratings_per_score.get(count, 0) for count in range(1, 6)}
+    num_of_ratings = sum(ratings_per_score.values())
     # Avoid runtime error by checking it will not divide by 0
     if num_of_ratings != 0:
-        average_rating = sum(scores) / num_of_ratings
+        average_rating = sum(score * count for score, count in ratings_per_score.items()) / num_of_ratings
     else:
         average_rating = "N/A"
 
@@ -890,6 +946,340 @@ def create_product_summary(product_id: int, days_back: int):
     return file_name
 
 
+class VigenereCipher:
+    """
+    Data structure that encrypts and decrypts text using an ASCII version of the Vigenere cipher.
+    A translation table is built once for each character of the key, so each string is
+    encrypted or decrypted in a single pass without rebuilding the Vigenere table.
+    VISUAL REPRESENTATION OF THE CIPHER CAN BE FOUND IN DESIGN DOCUMENTS
+
+    Parameters
+    ----------
+    plaintext_key : str
+        The key used to encrypt and decrypt
+    """
+    # Starts at 32 and not 0 as ASCII values 0 - 32 are unusable
+    first_character = 32
+    table_size = 95
+
+    def __init__(self, plaintext_key: str):
+        self.key_length = len(plaintext_key)
+        self.encryption_tables = []
+        self.decryption_tables = []
+        for key_character in plaintext_key:
+            # Each key character shifts the alphabet by its position in the table
+            shift = ord(key_character) - self.first_character
+            # Characters below 32 wrap round to the end of the table
+            self.encryption_tables.append({code: self.first_character + ((code - self.first_character) % self.table_size + shift) % self.table_size
+                                           for code in range(self.first_character + self.table_size)})
+            self.decryption_tables.append({code: self.first_character + (code - self.first_character - shift) % self.table_size
+                                           for code in range(self.first_character, self.first_character + self.table_size)})
+
+    def translate(self, text: str, tables: list, lowest_character: str):
+        """
+        Translates every character of a string by the table for its position in the key
+
+        Parameters
+        ----------
+        text : str
+            The string to translate
+
+        tables : list
+            The translation table for each position in the key
+
+        lowest_character : str
+            The lowest character the tables can translate
+
+        Returns
+        -------
+        str
+            The translated string
+        """
+        if text == "":
+            return text
+        if max(text) > "~" or min(text) < lowest_character:
+            raise ValueError(f"'{text}' contains characters that cannot be used with the cipher")
+        # Every key position translates every key_length-th character, starting from that position
+        characters = [""] * len(text)
+        for position, table in enumerate(tables):
+            characters[position::self.key_length] = text[position::self.key_length].translate(table)
+        return "".join(characters)
+
+    def encrypt(self, decrypted_text: str):
+        """
+        Encrypts a string
+
+        Parameters
+        ----------
+        decrypted_text : str
+            The string to encrypt
+
+        Returns
+        -------
+        str
+            The encrypted string
+        """
+        return self.translate(decrypted_text, self.encryption_tables, "\x00")
+
+    def decrypt(self, encrypted_text: str):
+        """
+        Decrypts a string
+
+        Parameters
+        ----------
+        encrypted_text : str
+            The string to decrypt
+
+        Returns
+        -------
+        str
+            The decrypted string
+        """
+        return self.translate(encrypted_text, self.decryption_tables, " ")
+
+
+class Keyring:
+    """
+    Data structure that holds every version of the encryption key, so that fields encrypted with an
+    older key can still be decrypted whilst the database is being re-encrypted with the newest one.
+    Version 1 is the original key and its ciphertext is stored as it always has been. Ciphertext from
+    later versions is prefixed with its version i.e. "\x1b2:" which the cipher can never produce itself.
+
+    The key file holds the keys in plaintext, so it must never be committed or shared. It is created readable
+    only by its owner and must be kept with the database, as fields encrypted with its keys cannot be read without it
+
+    Parameters
+    ----------
+    file_name : str
+        The name of the file that holds the keys added after the original, one "version:key" per line.
+        Defaults to "encryption_keys.txt"
+    """
+    version_marker = "\x1b"
+
+    def __init__(self, file_name: str = "encryption_keys.txt"):
+        self.file_name = file_name
+        self.load()
+
+    def load(self):
+        """
+        Reads the keys from the key file
+        """
+        ciphers = {1: VigenereCipher("pepsi_max")}
+        if os.path.exists(self.file_name):
+            with open(self.file_name, "r") as key_file:
+                for line in key_file:
+                    if line.strip() != "":
+                        version, plaintext_key = line.rstrip("\n").split(":", 1)
+                        ciphers[int(version)] = VigenereCipher(plaintext_key)
+        self.ciphers = ciphers
+        self.current_version = max(ciphers)
+
+    def add_key(self, plaintext_key: str):
+        """
+        Adds a new key, which becomes the current version used to encrypt
+
+        Parameters
+        ----------
+        plaintext_key : str
+            The new key
+
+        Returns
+        -------
+        int
+            The version of the new key
+        """
+        if plaintext_key == "" or max(plaintext_key) > "~" or min(plaintext_key) < " ":
+            raise ValueError("The key must only contain letters, numbers, spaces and symbols")
+        new_version = self.current_version + 1
+        # Only the owner may read the keys
+        with open(os.open(self.file_name, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600), "a") as key_file:
+            key_file.write(f"{new_version}:{plaintext_key}\n")
+        self.load()
+        return new_version
+
+    def get_cipher(self, version: int):
+        """
+        Gets the cipher for a version of the key
+
+        Parameters
+        ----------
+        version : int
+            The version of the key
+
+        Returns
+        -------
+        VigenereCipher
+            The cipher using that version of the key
+        """
+        return self.ciphers[version]
+
+    def get_version(self, encrypted_text: str):
+        """
+        Gets the version of the key that a field was encrypted with
+
+        Parameters
+        ----------
+        encrypted_text : str
+            The encrypted field
+
+        Returns
+        -------
+        int
+            The version of the key
+        """
+        if encrypted_text.startswith(self.version_marker):
+            return int(encrypted_text[1:encrypted_text.index(":")])
+        return 1
+
+    def get_active_versions(self, rotating: bool):
+        """
+        Gets the versions of the key that fields in the database may currently be encrypted with
+
+        Parameters
+        ----------
+        rotating : bool
+            Whether a key rotation has not finished, in which case the database holds more than one version
+
+        Returns
+        -------
+        list
+            The versions of the key
+        """
+        if rotating:
+            return sorted(self.ciphers)
+        return [self.current_version]
+
+    def encrypt(self, decrypted_text: str, version: int = None):
+        """
+        Encrypts a string, prefixing it with the version of the key used
+
+        Parameters
+        ----------
+        decrypted_text : str
+            The string to encrypt
+
+        version : int
+            The version of the key to encrypt with.
+            Defaults to the current version
+
+        Returns
+        -------
+        str
+            The encrypted string
+        """
+        if version is None:
+            version = self.current_version
+        encrypted_text = self.ciphers[version].encrypt(decrypted_text)
+        # The original key's ciphertext is left unprefixed so that existing fields stay valid
+        if version == 1:
+            return encrypted_text
+        return f"{self.version_marker}{version}:{encrypted_text}"
+
+    def decrypt(self, encrypted_text: str):
+        """
+        Decrypts a string encrypted with any version of the key
+
+        Parameters
+        ----------
+        encrypted_text : str
+            The string to decrypt
+
+        Returns
+        -------
+        str
+            The decrypted string
+        """
+        if encrypted_text.startswith(self.version_marker):
+            separator = encrypted_text.index(":")
+            return self.ciphers[int(encrypted_text[1:separator])].decrypt(encrypted_text[separator + 1:])
+        return self.ciphers[1].decrypt(encrypted_text)
+
+
+keyring = Keyring()
+
+# Fields that are looked up by equality and so are given a blind index column i.e. "username_blind_index"
+blind_indexed_fields = ["username", "email_address", "card_number"]
+blind_index_columns = frozenset(f"{field_name}_blind_index" for field_name in blind_indexed_fields)
+blind_index_key = b"turtle_tennis_blind_index"
+# Columns maintained by the database itself, which are left out of records, forms and the treeview
+internal_columns = blind_index_columns | frozenset(["rating_count", "rating_sum"])
+
+
+def get_blind_index_column(field_name: str):
+    """
+    Gets the name of the column that holds the blind index of a field
+
+    Parameters
+    ----------
+    field_name : str
+        The name of the field
+
+    Returns
+    -------
+    str
+        The name of the blind index column
+    """
+    return f"{field_name}_blind_index"
+
+
+def get_blind_index(value):
+    """
+    Calculates the blind index of a field value. This is a keyed hash of the decrypted value, so equal
+    values always have equal blind indexes whether or not encryption is enabled, without the
+    blind index revealing the value
+
+    Parameters
+    ----------
+    value : any
+        The decrypted field value
+
+    Returns
+    -------
+    str
+        The blind index as 32 hexadecimal characters
+    """
+    return hmac.new(blind_index_key, str(value).encode(), hashlib.sha256).hexdigest()[:32]
+
+
+# Fields that are never encrypted, shared by encrypt, decrypt and the decryption of search results
+plaintext_fields = frozenset(list(internal_columns) + ["customer_id",
+                              "staff_id",
+                              "weekly_hours",
+                              "payment_card_id",
+                              "order_id",
+                              "date",
+                              "delivery_cost",
+                              "total_cost",
+                              "supplier_id",
+                              "current_stock",
+                              "average_rating",
+                              "order_cost",
+                              "sale_price",
+                              "total_sold",
+                              "product_id",
+                              "order_product_id",
+                              "quantity",
+                              "rating_id",
+                              "score"])
+
+
+def is_encrypted_field(field_name: str):
+    """
+    Checks whether a field is stored encrypted when encryption is enabled
+
+    Parameters
+    ----------
+    field_name : str
+        The name of the field
+
+    Returns
+    -------
+    bool
+        True if the field is encrypted
+    """
+    return field_name not in plaintext_fields
+
+
 def decrypt(field_name, encrypted_field, override_encryption_status = False):
     """
     Decrypts the field using an ASCII version of the Vigenere cipher
@@ -904,56 +1294,10 @@ def decrypt(field_name, encrypted_field, override_encryption_status = False):
     str
         The decrypted field
     """
-    do_not_decrypt_fields = ["customer_id",
-                             "staff_id",
-                             "weekly_hours",
-                             "payment_card_id",
-                             "order_id",
-                             "date",
-                             "delivery_cost",
-                             "total_cost",
-                             "supplier_id",
-                             "current_stock",
-                             "average_rating",
-                             "order_cost",
-                             "sale_price",
-                             "total_sold",
-                             "product_id",
-                             "order_product_id",
-                             "quantity",
-                             "rating_id",
-                             "score"]
-    if field_name in do_not_decrypt_fields or (not get_should_encrypt() and not override_encryption_status):
+    if field_name in plaintext_fields or (not get_should_encrypt() and not override_encryption_status):
         return encrypted_field
     else:
-        plaintext_key = "pepsi_max"
-        # Convert key into list of ASCII values
-        key_ascii_values = [ord(character) for character in plaintext_key]
-
-        table_range = [integer for integer in range(32, 127)]
-        # Source: https://stackoverflow.com/questions/47369057/generate-vigen%C3%A8re-cypher-table-in-python
-        vigenere_table = [table_range[i:] + table_range[:i] for i in range(len(table_range))]
-
-        key_pointer = 0
-        decrypted_field = ""
-        for character in str(encrypted_field):
-            column = key_ascii_values[key_pointer] - 32
-            # Get the row where the column number is the ASCII value of the encrypted character
-            row = [row for row in vigenere_table if row[column] == ord(character)]
-            # Trace to start of said row (that will be the ASCII value of the decrypted character)
-            decrypted_character = chr(row[0][0])
-            if decrypted_character == "'" and not get_should_encrypt():
-                # Change ' into '' to avoid SQL insertion errors
-                decrypted_field += "''"
-            else:
-                decrypted_field += decrypted_character
-            # If key has looped back to the beginning
-            if key_pointer + 1 > len(key_ascii_values) - 1:
-                key_pointer = 0
-            else:
-                key_pointer += 1
-
-        return decrypted_field
+        return keyring.decrypt(str(encrypted_field))
 
 
 def encrypt(field_name, decrypted_field, override_encryption_status = False):
@@ -970,90 +1314,419 @@ def encrypt(field_name, decrypted_field, override_encryption_status = False):
     str
         The encrypted field
     """
-    do_not_encrypt_fields = ["customer_id",
-                             "staff_id"
-                             "weekly_hours",
-                             "payment_card_id",
-                             "order_id",
-                             "date",
-                             "delivery_cost",
-                             "total_cost",
-                             "supplier_id",
-                             "current_stock",
-                             "average_rating",
-                             "order_cost",
-                             "sale_price",
-                             "total_sold",
-                             "product_id",
-                             "order_product_id",
-                             "quantity",
-                             "rating_id",
-                             "score"]
-    if field_name in do_not_encrypt_fields or (not get_should_encrypt() and not override_encryption_status):
+    if field_name in plaintext_fields or (not get_should_encrypt() and not override_encryption_status):
         return str(decrypted_field)
     else:
-        plaintext_key = "pepsi_max"
-        # Convert key into list of ASCII values
-        key_ascii_values = [ord(character) for character in plaintext_key]
-
-        # Starts at 32 and not 0 as ASCII values 0 - 32 are unusable
-        table_range = [integer for integer in range(32, 127)]
-        # Source: https://stackoverflow.com/questions/47369057/generate-vigen%C3%A8re-cypher-table-in-python
-        vigenere_table = [table_range[i:] + table_range[:i] for i in range(len(table_range))]
-
-        key_pointer = 0
-        encrypted_field = ""
-        for character in decrypted_field:
-            row = ord(character) - 32
-            # Column is detemined by the current key character value
-            column = key_ascii_values[key_pointer] - 32
-            # VISUAL REPRESENTATION OF WHAT IS HAPPENING CAN BE FOUND IN DESIGN DOCUMENTS
-            encrypted_character = chr(vigenere_table[row][column])
-            if encrypted_character == "'" and get_should_encrypt():
-                # Change ' into '' to avoid SQL insertion errors
-                encrypted_field += "''"
-            else:
-                encrypted_field += encrypted_character
-            # If key has looped back to beginning
-            if key_pointer + 1 > len(key_ascii_values)-1:
-                key_pointer = 0
-            else:
-                key_pointer += 1
+        return keyring.encrypt(str(decrypted_field))
 
-        return encrypted_field
 
+# Tables whose fields are encrypted, in the order they are re-encrypted
+encrypted_tables = ["Customer", "Order_Product", "Orders", "Payment_Card", "Product", "Ratings", "Staff", "Supplier"]
+# The fewest rows a re-encryption must rewrite before it uses a process pool. Each process imports this module
+# and its libraries when it starts, which takes longer than rewriting a small database in this process
+process_pool_min_rows = 50000
+
+
+def transform_rows(rows: list,
+                   encrypting: bool):
+    """
+    Encrypts or decrypts the encrypted fields of rows read directly from the database
+
+    Parameters
+    ----------
+    rows : list
+        The rows to transform, each a list of stored encrypted field values followed by the row's primary key
+
+    encrypting : bool
+        True to encrypt the rows, False to decrypt them
+
+    Returns
+    -------
+    list
+        The transformed rows in the same format, ready to be bound to an UPDATE ... WHERE primary key = ?
+    """
+    transform = keyring.encrypt if encrypting else keyring.decrypt
+    transformed_rows = []
+    for row in rows:
+        # Null fields are left as they are
+        transformed_row = [value if value is None else transform(str(value)) for value in row[:-1]]
+        transformed_row.append(row[-1])
+        transformed_rows.append(transformed_row)
+    return transformed_rows
+
+
+def get_encrypted_fields_per_table():
+    """
+    Gets the encrypted fields of every table that has any
+
+    Returns
+    -------
+    dict
+        Keys state the table name.
+        Values state the names of its encrypted fields
+    """
+    fields_per_table = {}
+    for table_name in encrypted_tables:
+        field_names = [field_name for field_name in crud.get_table_headings("ecommerce", table_name) if is_encrypted_field(field_name)]
+        if field_names:
+            fields_per_table[table_name] = field_names
+    return fields_per_table
+
+
+def reencrypt_database(encrypting: bool,
+                       progress_callback=None,
+                       chunk_size: int = 500,
+                       workers: int = 1):
+    """
+    Encrypts or decrypts every stored field of the database. Each table is read in chunks ordered by
+    primary key, and each chunk is rewritten with one executemany in a transaction that also records
+    how far the job has got, so an interrupted run resumes from the last chunk written.
+    With more than one worker and at least process_pool_min_rows rows left to rewrite, chunks are encrypted
+    or decrypted in parallel by a process pool while this process reads the chunks and writes the results back in order
+
+    Parameters
+    ----------
+    encrypting : bool
+        True to encrypt the database, False to decrypt it
+
+    progress_callback : function
+        Called after each chunk with the number of rows done and the total number of rows.
+        Defaults to None
+
+    chunk_size : int
+        The number of rows rewritten per transaction.
+        Defaults to 500
+
+    workers : int
+        The most processes that encrypt or decrypt chunks.
+        Defaults to 1, which does all the work in this process
+    """
+    conn, cur = crud.open_database("ecommerce")
+    # Only tables with encrypted fields need rewriting
+    fields_per_table = get_encrypted_fields_per_table()
+    total_rows = sum(crud.aggregate("ecommerce", table_name, {"*": "count"}) for table_name in fields_per_table)
+
+    # Each row is (encrypting, table name, last primary key written)
+    progress = cur.execute("SELECT encrypting, table_name, last_id FROM Reencryption_Progress WHERE job_id = 1").fetchone()
+    if progress is not None and bool(progress[0]) != encrypting:
+        raise ValueError("An interrupted re-encryption in the other direction must be finished first")
+    rows_done = 0
+    tables_to_rewrite = list(fields_per_table)
+    if progress is not None:
+        # Skip the tables that were finished before the interruption
+        tables_to_rewrite = tables_to_rewrite[tables_to_rewrite.index(progress[1]):]
+        for table_name in fields_per_table:
+            if table_name == progress[1]:
+                break
+            rows_done += crud.aggregate("ecommerce", table_name, {"*": "count"})
+
+    def write_chunk(table_name, update_command, last_id, transformed_rows):
+        nonlocal rows_done
+        # Write the chunk and the checkpoint together
+        with crud.transaction("ecommerce") as tx:
+            tx.cursor.executemany(update_command, transformed_rows)
+            # Records read part-way through would be decrypted according to the wrong status
+            crud.record_writes("ecommerce", {table_name})
+            tx.cursor.execute("INSERT OR REPLACE INTO Reencryption_Progress (job_id, encrypting, table_name, last_id) VALUES (1, ?, ?, ?)",
+                              [int(encrypting), table_name, last_id])
+        rows_done += len(transformed_rows)
+        if progress_callback is not None:
+            progress_callback(rows_done, total_rows)
+
+    # Rows already rewritten in the interrupted table are counted as left, which only matters near the threshold
+    use_pool = workers > 1 and total_rows - rows_done >= process_pool_min_rows
+    executor = ProcessPoolExecutor(max_workers=workers) if use_pool else None
+    # Chunks being transformed by the workers, written as [table name, update command, last id, future].
+    # Kept in the order they were read so that checkpoints are always written in order
+    pending_chunks = deque()
+    try:
+        for table_name in tables_to_rewrite:
+            field_names = fields_per_table.get(table_name)
+            primary_key = crud.get_table_schema("ecommerce", table_name).get("primary_key")
+            last_id = 0
+            if progress is not None and table_name == progress[1]:
+                last_id = progress[2]
+                rows_done += crud.aggregate("ecommerce", table_name, {"*": "count"}, {primary_key: {"<=": last_id}})
+
+            select_command = f"""SELECT {", ".join(field_names)}, {primary_key} FROM {table_name}
+                                 WHERE {primary_key} > ? ORDER BY {primary_key} LIMIT ?"""
+            assignments = ", ".join(f"{field_name} = ?" for field_name in field_names)
+            update_command = f"UPDATE {table_name} SET {assignments} WHERE {primary_key} = ?"
+            while True:
+                rows = cur.execute(select_command, [last_id, chunk_size]).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][-1]
+                if executor is None:
+                    write_chunk(table_name, update_command, last_id, transform_rows(rows, encrypting))
+                    continue
+                pending_chunks.append([table_name, update_command, last_id, executor.submit(transform_rows, rows, encrypting)])
+                # Limit how many chunks are held in memory whilst waiting to be written
+                if len(pending_chunks) >= workers * 2:
+                    table_to_write, update_to_run, chunk_last_id, future = pending_chunks.popleft()
+                    write_chunk(table_to_write, update_to_run, chunk_last_id, future.result())
+
+        while pending_chunks:
+            table_to_write, update_to_run, chunk_last_id, future = pending_chunks.popleft()
+            write_chunk(table_to_write, update_to_run, chunk_last_id, future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with crud.transaction("ecommerce") as tx:
+        tx.cursor.execute("DELETE FROM Reencryption_Progress")
+
+
+def get_interrupted_reencryption():
+    """
+    Gets the direction of a re-encryption that was interrupted before it finished
+
+    Returns
+    -------
+    bool | None
+        True if an encryption was interrupted, False if a decryption was interrupted or None if neither
+    """
+    conn, cur = crud.open_database("ecommerce")
+    progress = cur.execute("SELECT encrypting FROM Reencryption_Progress WHERE job_id = 1").fetchone()
+    return None if progress is None else bool(progress[0])
+
+
+def apply_encryption_status(progress_callback=None,
+                            workers: int = 1):
+    """
+    Encrypts or decrypts the database if the encryption status has changed since the application was last run,
+    finishing any re-encryption that was interrupted first
+
+    Parameters
+    ----------
+    progress_callback : function
+        Called after each chunk with the number of rows done and the total number of rows.
+        Defaults to None
+
+    workers : int
+        The most processes that encrypt or decrypt chunks, which are only started for large databases.
+        Defaults to 1
+    """
+    interrupted_encrypting = get_interrupted_reencryption()
+    if interrupted_encrypting is not None:
+        reencrypt_database(interrupted_encrypting, progress_callback, workers=workers)
+
+    admin_account = crud.search_table("ecommerce", "Staff", "*", {"staff_id": 1})[0]
+    if get_should_encrypt() and admin_account.get("username")[0] == "|":
+        encrypt_all(progress_callback, workers)
+    elif not get_should_encrypt() and admin_account.get("username")[0] in ["^", keyring.version_marker]:
+        decrypt_all(progress_callback, workers)
+
+
+def get_search_ciphertexts(field_name: str, value):
+    """
+    Gets every stored form a field value could currently have, as a key rotation leaves fields
+    encrypted with different versions of the key until it finishes
+
+    Parameters
+    ----------
+    field_name : str
+        The name of the field
+
+    value : any
+        The decrypted field value
+
+    Returns
+    -------
+    list
+        The stored forms of the value
+    """
+    if field_name in plaintext_fields or not get_should_encrypt():
+        return [str(value)]
+    return [keyring.encrypt(str(value), version) for version in keyring.get_active_versions(is_key_rotating())]
+
+
+# Whether a key rotation has not finished, read from Key_Rotation_Progress on first use and then kept up to date
+# by the rotation, so that searches match every version of the key after a restart part-way through
+key_rotation_running = None
 
-def encrypt_all():
-    tables = ["Customer", "Order_Product", "Orders", "Payment_Card", "Product", "Ratings", "Staff", "Supplier"]
-    for table_name in tables:
-        records = crud.search_table("ecommerce", table_name, "*", "")
-        for record in records:
-            new_record = {}
-            for field_name, value in record.items():
-                if field_name[-2:] != "id":
-                    new_record[field_name] = backend.encrypt(field_name, value, override_encryption_status=True)
-            id_name, id_value = list(record.items())[0]
-            crud.update_record("ecommerce",
-                               table_name,
-                               new_record,
-                               f"{id_name} = '{id_value}'")
-
-
-def decrypt_all():
-    tables = ["Customer", "Order_Product", "Orders", "Payment_Card", "Product", "Ratings", "Staff", "Supplier"]
-    for table_name in tables:
-        records = crud.search_table("ecommerce", table_name, "*", "")
-        for record in records:
-            new_record = {}
-            for field_name, value in record.items():
-                if field_name[-2:] != "id":
-                    new_record[field_name] = backend.decrypt(field_name, value, override_encryption_status=True)
-            print(new_record)
-            id_name, id_value = list(record.items())[0]
-            crud.update_record("ecommerce",
-                               table_name,
-                               new_record,
-                               f"{id_name} = '{id_value}'")
+
+def is_key_rotating():
+    """
+    Checks whether a key rotation has started and not finished, so that fields may be encrypted with more than one key
+
+    Returns
+    -------
+    bool
+        True if a key rotation has not finished
+    """
+    global key_rotation_running
+    if key_rotation_running is None:
+        key_rotation_running = get_key_rotation_progress() is not None
+    return key_rotation_running
+
+
+def set_key_rotating(rotating: bool):
+    """
+    Records whether a key rotation is running, as it is started or finished alongside Key_Rotation_Progress
+
+    Parameters
+    ----------
+    rotating : bool
+        True if a key rotation has not finished
+    """
+    global key_rotation_running
+    key_rotation_running = rotating
+
+
+def get_key_rotation_progress():
+    """
+    Gets how far the current key rotation has got
+
+    Returns
+    -------
+    dict | None
+        "to_version" states the version of the new key, "rows_done" the number of records re-encrypted so far
+        and "total_rows" the number of records to re-encrypt. None if no key rotation is running
+    """
+    conn, cur = crud.open_database("ecommerce")
+    progress = cur.execute("SELECT to_version, rows_done, total_rows FROM Key_Rotation_Progress WHERE job_id = 1").fetchone()
+    if progress is None:
+        return None
+    return {"to_version": progress[0],
+            "rows_done": progress[1],
+            "total_rows": progress[2]}
+
+
+def start_key_rotation(new_key: str):
+    """
+    Adds a new encryption key and starts re-encrypting the database with it in the background
+
+    Parameters
+    ----------
+    new_key : str
+        The new key
+
+    Returns
+    -------
+    int
+        The version of the new key
+    """
+    if not get_should_encrypt():
+        raise ValueError("Encryption must be enabled to rotate the key")
+    if get_key_rotation_progress() is not None:
+        raise ValueError("A key rotation is already running")
+    fields_per_table = get_encrypted_fields_per_table()
+    total_rows = sum(crud.aggregate("ecommerce", table_name, {"*": "count"}) for table_name in fields_per_table)
+
+    # Fields written from now on use the new key, so searches must match both versions until the rotation finishes
+    set_key_rotating(True)
+    new_version = keyring.add_key(new_key)
+    with crud.transaction("ecommerce") as tx:
+        tx.cursor.execute("""INSERT INTO Key_Rotation_Progress (job_id, to_version, table_name, last_id, rows_done, total_rows)
+                             VALUES (1, ?, ?, 0, 0, ?)""", [new_version, list(fields_per_table)[0], total_rows])
+    resume_key_rotation()
+    return new_version
+
+
+def resume_key_rotation():
+    """
+    Starts the background worker for a key rotation that has not finished i.e. after the application restarts
+
+    Returns
+    -------
+    threading.Thread | None
+        The worker thread, or None if no key rotation needs to run
+    """
+    if get_key_rotation_progress() is None:
+        return None
+    if not get_should_encrypt():
+        # The database has been decrypted so there is nothing left to rotate
+        with crud.transaction("ecommerce") as tx:
+            tx.cursor.execute("DELETE FROM Key_Rotation_Progress")
+        set_key_rotating(False)
+        return None
+    set_key_rotating(True)
+    worker = threading.Thread(target=rotate_key, daemon=True)
+    worker.start()
+    return worker
+
+
+def rotate_key(batch_size: int = 100,
+               pause: float = 0.05):
+    """
+    Re-encrypts every field that is not yet encrypted with the current key's version. Each small batch
+    is read and rewritten in its own short transaction together with the progress made, so the
+    application can keep reading and writing between batches and an interrupted rotation resumes.
+    If the rotation fails, it is no longer treated as running until it resumes when the application next starts
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of records re-encrypted per transaction.
+        Defaults to 100
+
+    pause : float
+        The number of seconds to wait between batches.
+        Defaults to 0.05
+    """
+    try:
+        conn, cur = crud.open_database("ecommerce")
+        to_version, starting_table, last_id, rows_done = cur.execute("""SELECT to_version, table_name, last_id, rows_done
+                                                                        FROM Key_Rotation_Progress WHERE job_id = 1""").fetchone()
+        fields_per_table = get_encrypted_fields_per_table()
+        tables_to_rotate = list(fields_per_table)
+        tables_to_rotate = tables_to_rotate[tables_to_rotate.index(starting_table):]
+        for table_name in tables_to_rotate:
+            field_names = fields_per_table.get(table_name)
+            primary_key = crud.get_table_schema("ecommerce", table_name).get("primary_key")
+            if table_name != starting_table:
+                last_id = 0
+            select_command = f"""SELECT {", ".join(field_names)}, {primary_key} FROM {table_name}
+                                 WHERE {primary_key} > ? ORDER BY {primary_key} LIMIT ?"""
+            assignments = ", ".join(f"{field_name} = ?" for field_name in field_names)
+            update_command = f"UPDATE {table_name} SET {assignments} WHERE {primary_key} = ?"
+            while True:
+                # Stop if the database is being decrypted, as there is nothing left to rotate
+                if not get_should_encrypt():
+                    with crud.transaction("ecommerce") as tx:
+                        tx.cursor.execute("DELETE FROM Key_Rotation_Progress")
+                    set_key_rotating(False)
+                    return
+                # Reading and writing in one transaction means a record cannot be changed in between
+                with crud.transaction("ecommerce") as tx:
+                    rows = tx.cursor.execute(select_command, [last_id, batch_size]).fetchall()
+                    rotated_rows = []
+                    for row in rows:
+                        values = row[:-1]
+                        if any(value is not None and keyring.get_version(str(value)) != to_version for value in values):
+                            rotated_rows.append([value if value is None or keyring.get_version(str(value)) == to_version
+                                                 else keyring.encrypt(keyring.decrypt(str(value)), to_version)
+                                                 for value in values] + [row[-1]])
+                    # Only the ciphertext changes, so cached decrypted records are left as they are
+                    tx.cursor.executemany(update_command, rotated_rows)
+                    if rows:
+                        last_id = rows[-1][-1]
+                        rows_done += len(rows)
+                        tx.cursor.execute("UPDATE Key_Rotation_Progress SET table_name = ?, last_id = ?, rows_done = ? WHERE job_id = 1",
+                                          [table_name, last_id, rows_done])
+                if not rows:
+                    break
+                # Give the application a turn at the database
+                time.sleep(pause)
+
+        with crud.transaction("ecommerce") as tx:
+            tx.cursor.execute("DELETE FROM Key_Rotation_Progress")
+        set_key_rotating(False)
+    except Exception:
+        # Searches stop matching every version of the key. Key_Rotation_Progress is kept so the rotation resumes
+        set_key_rotating(False)
+        raise
+    finally:
+        crud.close_thread_connections()
+
+
+def encrypt_all(progress_callback=None, workers: int = 1):
+    reencrypt_database(True, progress_callback, workers=workers)
+
+
+def decrypt_all(progress_callback=None, workers: int = 1):
+    reencrypt_database(False, progress_callback, workers=workers)
 
 
 def decrease_stock_by(product_id: int,
@@ -1070,14 +1743,110 @@ def decrease_stock_by(product_id: int,
         The amount by which the stock should decrease by.
         Defaults to 1
     """
-    current_stock = crud.search_table("ecommerce",
-                                      "Product",
-                                      ["current_stock"],
-                                      f"product_id = '{product_id}'")[0].get("current_stock")
-    crud.update_record("ecommerce",
-                       "Product",
-                       {"current_stock": current_stock - amount},
-                       f"product_id = '{product_id}'")
+    crud.increment_fields("ecommerce",
+                          "Product",
+                          {"current_stock": -amount},
+                          {"product_id": product_id})
+
+
+class InsufficientStockError(ValueError):
+    """
+    Raised when an order asks for more of a product than is in stock
+
+    Parameters
+    ----------
+    shortfalls : dict
+        Keys state the IDs of the products that are short.
+        Values state the stock that is available for each
+    """
+    def __init__(self, shortfalls: dict):
+        super().__init__("Not enough stock for products " + ", ".join(f"{product_id} ({available_stock} available)"
+                                                                      for product_id, available_stock in shortfalls.items()))
+        self.shortfalls = shortfalls
+
+
+def reserve_stock(products: list):
+    """
+    Takes the stock for every line of an order. Each line's stock is only decreased if enough is left,
+    checked and written in one statement, so concurrent orders cannot both take the last of a product.
+    If any line is short, none of the stock is taken
+
+    Parameters
+    ----------
+    products : list
+        A list of dictionaries, each holding the "product_id" and "quantity" of an order line
+
+    Raises
+    ------
+    InsufficientStockError
+        If any product does not have enough stock, giving the stock available for each that is short
+    """
+    shortfalls = {}
+    # A savepoint when called inside the order's transaction, so a shortfall only undoes the reservations
+    with crud.transaction("ecommerce"):
+        for product in products:
+            reserved = crud.increment_fields("ecommerce",
+                                             "Product",
+                                             {"current_stock": -product.get("quantity")},
+                                             {"product_id": product.get("product_id"),
+                                              "current_stock": {">=": product.get("quantity")}})
+            if not reserved:
+                shortfalls[product.get("product_id")] = crud.search_table("ecommerce",
+                                                                          "Product",
+                                                                          ["current_stock"],
+                                                                          {"product_id": product.get("product_id")})[0].get("current_stock")
+        if shortfalls:
+            raise InsufficientStockError(shortfalls)
+
+
+# The records that can be deleted along with their orders, and the field of Orders that links to each
+cascade_delete_fields = {"Customer": "customer_id",
+                         "Payment_Card": "payment_card_id",
+                         "Orders": "order_id"}
+
+
+def delete_with_cascade(table_name: str,
+                        record_id: int):
+    """
+    Deletes a customer, payment card or order along with every record linked to it, in one transaction.
+    The stock of all pending orders being deleted is refunded in a single statement, and the total sold
+    and average ratings are kept up to date by the Order_Product and Ratings triggers as the linked records are deleted
+
+    Parameters
+    ----------
+    table_name : str
+        The table of the record i.e. "Customer", "Payment_Card" or "Orders"
+
+    record_id : int
+        The ID of the record to delete
+
+    Returns
+    -------
+    int
+        The number of products that had stock refunded
+    """
+    id_field_name = cascade_delete_fields.get(table_name)
+    if id_field_name is None:
+        raise ValueError(f"Cascading deletes are not supported for {table_name}")
+
+    condition_string, condition_values = crud.build_conditions({f"Orders.{id_field_name}": record_id,
+                                                                "Orders.delivery_status": "Pending"},
+                                                               crud.get_blind_indexes("ecommerce", ["Orders"]))
+    pending_lines = f"""FROM Order_Product JOIN Orders ON Orders.order_id = Order_Product.order_id
+                        WHERE {condition_string}"""
+    with crud.transaction("ecommerce") as tx:
+        # Every product in the pending orders gets back the total quantity ordered across them
+        tx.cursor.execute(f"""UPDATE Product
+                              SET current_stock = current_stock + (SELECT SUM(Order_Product.quantity) {pending_lines}
+                                                                   AND Order_Product.product_id = Product.product_id)
+                              WHERE product_id IN (SELECT Order_Product.product_id {pending_lines})""",
+                          condition_values * 2)
+        products_refunded = tx.cursor.rowcount
+        crud.record_writes("ecommerce", {"Product"})
+        crud.delete_record("ecommerce",
+                           table_name,
+                           {id_field_name: record_id})
+    return products_refunded
 
 
 def filter_products(products: list,
@@ -1218,24 +1987,33 @@ def load_and_resize_image(image_file: str,
                         size=(width, height))
 
 
-def update_total_sold(product_id: int):
+def verify_total_sold(repair: bool = False):
     """
-    Update the total sold for a particular product
+    Checks every product's total sold against its order lines in one query. The total sold is kept up to date
+    by triggers on Order_Product, so this should only find differences if the triggers were bypassed
 
     Parameters
     ----------
-    product_id : int
-        The ID of the product
-    """
-    orders_with_product = crud.search_table("ecommerce",
-                                            "Order_Product",
-                                            ["*"],
-                                            f"product_id = '{product_id}'")
-    quantities_bought = [order.get("quantity") for order in orders_with_product]
-    crud.update_record("ecommerce",
-                       "Product",
-                       {"total_sold": f"{sum(quantities_bought)}"},
-                       f"product_id = {product_id}")
+    repair : bool
+        Whether any incorrect totals should be corrected.
+        Defaults to False
+
+    Returns
+    -------
+    dict
+        Keys state the IDs of products with an incorrect total sold.
+        Values state [stored total sold, actual total sold]
+    """
+    with crud.transaction("ecommerce") as tx:
+        mismatches = tx.cursor.execute("""SELECT Product.product_id, Product.total_sold, TOTAL(Order_Product.quantity)
+                                          FROM Product LEFT JOIN Order_Product ON Order_Product.product_id = Product.product_id
+                                          GROUP BY Product.product_id
+                                          HAVING Product.total_sold != TOTAL(Order_Product.quantity)""").fetchall()
+        if repair:
+            tx.cursor.executemany("UPDATE Product SET total_sold = ? WHERE product_id = ?",
+                                  [[int(actual_total), product_id] for product_id, _, actual_total in mismatches])
+            crud.record_writes("ecommerce", {"Product"})
+    return {product_id: [stored_total, int(actual_total)] for product_id, stored_total, actual_total in mismatches}
     
 
 def process_order(user,
@@ -1243,7 +2021,7 @@ def process_order(user,
                   new_card_created: bool,
                   delivery_info: list):
     """
-    Creates the payment card, order and linking table records for an order and sends a receipt via email
+    Creates the payment card, order and linking table records for an order and queues its receipt to be emailed
 
     Parameters
     ----------
@@ -1265,78 +2043,130 @@ def process_order(user,
     Returns
     -------
     list
-        An integer for the id of the order created and a boolean value indicating
-        whether the email was successfully sent
-    """
-    # Create card if a new card was entered
-    if new_card_created:
-        crud.add_record("ecommerce",
-                        "Payment_Card",
-                        card_info)
-        payment_card_id = crud.search_table("ecommerce",
-                                            "Payment_Card",
-                                            ["*"],
-                                            f"card_number = '{encrypt('card_number', card_info.get('card_number'))}'")[0].get("payment_card_id")
-    else:
-        payment_card_id = card_info.get("payment_card_id")
+        An integer for the id of the order created and an integer for the id of
+        the job that emails the receipt
 
+    Raises
+    ------
+    InsufficientStockError
+        If any product in the basket no longer has enough stock, in which case nothing is written
+    """
     basket = user.get_basket()
-    customer_id = user.get_personal_id()
-
-    # Get the current date
-    date = datetime.today().strftime('%Y-%m-%d')
-    del_cost = basket.get_delivery_cost()
-    total_cost = basket.get_total()
-    del_status = "Pending"
-
-    order_dict = {"date": date,
-                  "delivery_address": delivery_info.get("delivery_address"),
-                  "delivery_postcode": delivery_info.get("delivery_postcode").upper(),
-                  "delivery_cost": del_cost,
-                  "total_cost": round(total_cost, 2),
-                  "delivery_status": del_status,
-                  "customer_id": customer_id,
-                  "payment_card_id": payment_card_id}
-    # Create order
-    crud.add_record("ecommerce",
-                    "Orders",
-                    order_dict)
-
-    # Get all order ids for the customer
-    order_ids = crud.search_table("ecommerce",
-                                  "Orders",
-                                  ["order_id"],
-                                  "")
-    # Get the last order id as it must be the most recent order made
-    order_id = order_ids[-1].get("order_id")
-
-    for product in basket.get_products():
-        order_product_dict = {"quantity": product.get("quantity"),
-                              "product_id": product.get("product_id"),
-                              "order_id": order_id}
-        # Create linking table record for that product
-        crud.add_record("ecommerce",
-                        "Order_Product",
-                        order_product_dict)
-        # Update stock and total sold
-        decrease_stock_by(order_product_dict.get("product_id"), order_product_dict.get("quantity"))
-        update_total_sold(order_product_dict.get("product_id"))
+    # The stock, card, order, order lines and total sold are committed together
+    with crud.transaction("ecommerce"):
+        # Take the stock first so that nothing else is written if any is short
+        reserve_stock(basket.get_products())
+
+        # Create card if a new card was entered
+        if new_card_created:
+            payment_card_id = crud.add_record("ecommerce",
+                                              "Payment_Card",
+                                              card_info)
+        else:
+            payment_card_id = card_info.get("payment_card_id")
+
+        customer_id = user.get_personal_id()
+
+        # Get the current date
+        date = datetime.today().strftime('%Y-%m-%d')
+        del_cost = basket.get_delivery_cost()
+        total_cost = basket.get_total()
+        del_status = "Pending"
+
+        order_dict = {"date": date,
+                      "delivery_address": delivery_info.get("delivery_address"),
+                      "delivery_postcode": delivery_info.get("delivery_postcode").upper(),
+                      "delivery_cost": del_cost,
+                      "total_cost": round(total_cost, 2),
+                      "delivery_status": del_status,
+                      "customer_id": customer_id,
+                      "payment_card_id": payment_card_id}
+        # Create order
+        order_id = crud.add_record("ecommerce",
+                                   "Orders",
+                                   order_dict)
+
+        order_product_dicts = [{"quantity": product.get("quantity"),
+                                "product_id": product.get("product_id"),
+                                "order_id": order_id}
+                               for product in basket.get_products()]
+        # Create linking table records for every product (the total sold is increased by the Order_Product triggers)
+        crud.add_records("ecommerce",
+                         "Order_Product",
+                         order_product_dicts)
+        # Queued with the order so the receipt is only sent if the order commits
+        receipt_job_id = get_job_queue().enqueue("order_receipt", {"order_id": order_id})
     basket.reset_basket()
 
-    name = user.get_name()
-    surname = user.get_surname()
+    return [order_id, receipt_job_id]
+
+
+def send_order_receipt(order_id: int):
+    """
+    Generates the receipt for an order and emails it to the customer. Run by the job queue, which is handed
+    the email's future rather than waiting for it, so that receipts are batched by the outbox
+
+    Parameters
+    ----------
+    order_id : int
+        The ID of the order
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Resolves once the email has been sent, or fails with ConnectionError if it could not be
+    """
+    customer = crud.search_joined_table("ecommerce",
+                                        "Orders",
+                                        [["Customer", "customer_id"]],
+                                        ["name", "surname", "email_address"],
+                                        {"order_id": order_id})[0]
+    name = customer.get("name")
+    surname = customer.get("surname")
     # Generate receipt pdf
     receipt_file = create_receipt(order_id=order_id,
                                   full_name=f"{name} {surname}")
 
     # Send the email
-    email_sent = send_email(user.get_email(),
+    email_sent = send_email(customer.get("email_address"),
                             subject="Your order receipt",
                             body_text=f"""Hi {name}, thanks for ordering with us!\nHere is a copy of your receipt. 
                             You can also view your past orders on the 'order history' section of our app!""",
-                            attachments=[receipt_file])
-    
-    return [order_id, email_sent]
+                            attachments=[receipt_file],
+                            wait=False)
+    receipt_sent = Future()
+
+    def check_email_sent(future: Future):
+        # Failing makes the job queue retry later
+        if future.result():
+            receipt_sent.set_result(True)
+        else:
+            receipt_sent.set_exception(ConnectionError("The receipt could not be emailed"))
+    email_sent.add_done_callback(check_email_sent)
+    return receipt_sent
+
+
+# Emails are sent in the background so that checkout does not wait for them.
+# The queue is created on first use so that importing this module never needs crud_functionality to be loaded
+job_queue = None
+job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Gets the queue that runs the application's background jobs i.e. emailing order receipts, creating it on first use
+
+    Returns
+    -------
+    jobs.JobQueue
+        The application's job queue
+    """
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = jobs.JobQueue("ecommerce")
+            job_queue.register("order_receipt", send_order_receipt)
+    return job_queue
 
 
 def remove_redundant_whitespace(string: str):
@@ -1396,12 +2226,394 @@ def search_products(products: list,
     return new_products
 
 
+class YagmailTransport:
+    """
+    Sends emails through Gmail, keeping one authenticated session open between messages
+
+    Parameters
+    ----------
+    user : str
+        The email address that messages are sent from.
+        Defaults to the company email
+
+    oauth2_file : str
+        The name of the oauth2 .JSON file used to authenticate.
+        Defaults to "oauth2-credits.json"
+    """
+    def __init__(self,
+                 user: str = "turtletennisgear@gmail.com",
+                 oauth2_file: str = "oauth2-credits.json"):
+        self.user = user
+        self.oauth2_file = oauth2_file
+        self.session = None
+
+    def open(self):
+        """
+        Connects and authenticates with the SMTP server
+        """
+        self.session = yagmail.SMTP(self.user, oauth2_file=self.oauth2_file)
+
+    def send(self, to_address: str, subject: str, contents: str, attachments: list):
+        """
+        Sends a message over the open session
+
+        Parameters
+        ----------
+        to_address : str
+            The email address of the recipient
+
+        subject : str
+            The title of the email
+
+        contents : str
+            The text contained within the email
+
+        attachments : list
+            The file names of attachments to be sent
+        """
+        self.session.send(to=to_address,
+                          subject=subject,
+                          contents=contents,
+                          attachments=attachments)
+
+    def close(self):
+        """
+        Ends the session
+        """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+class SMTPTransport:
+    """
+    Sends emails to any SMTP server i.e. a local stand-in for Gmail used in testing and benchmarks,
+    keeping one session open between messages
+
+    Parameters
+    ----------
+    host : str
+        The address of the SMTP server.
+        Defaults to "localhost"
+
+    port : int
+        The port of the SMTP server.
+        Defaults to 1025
+
+    sender : str
+        The email address that messages are sent from.
+        Defaults to the company email
+
+    username : str
+        The username to log in with, or None if the server does not need logging in to.
+        Defaults to None
+
+    password : str
+        The password to log in with.
+        Defaults to None
+
+    use_tls : bool
+        Whether the session should be upgraded to TLS.
+        Defaults to False
+
+    timeout : float
+        The number of seconds to wait for the server.
+        Defaults to 30
+    """
+    def __init__(self,
+                 host: str = "localhost",
+                 port: int = 1025,
+                 sender: str = "turtletennisgear@gmail.com",
+                 username: str = None,
+                 password: str = None,
+                 use_tls: bool = False,
+                 timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.session = None
+
+    def open(self):
+        """
+        Connects and authenticates with the SMTP server
+        """
+        self.session = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            self.session.starttls()
+        if self.username is not None:
+            self.session.login(self.username, self.password)
+
+    def send(self, to_address: str, subject: str, contents: str, attachments: list):
+        """
+        Sends a message over the open session
+
+        Parameters
+        ----------
+        to_address : str
+            The email address of the recipient
+
+        subject : str
+            The title of the email
+
+        contents : str
+            The text contained within the email
+
+        attachments : list
+            The file names of attachments to be sent
+        """
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to_address
+        message["Subject"] = subject
+        message.set_content(contents)
+        for file_name in attachments or []:
+            mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+            maintype, subtype = mime_type.split("/", 1)
+            with open(file_name, "rb") as attachment:
+                message.add_attachment(attachment.read(),
+                                       maintype=maintype,
+                                       subtype=subtype,
+                                       filename=os.path.basename(file_name))
+        self.session.send_message(message)
+
+    def close(self):
+        """
+        Ends the session
+        """
+        if self.session is not None:
+            try:
+                self.session.quit()
+            # SMTP errors are a kind of OSError
+            except OSError:
+                pass
+            self.session = None
+
+
+class Outbox:
+    """
+    Data structure that queues emails and sends them in batches from one thread over a single session,
+    so that messages do not each pay for connecting and authenticating. The session is closed after
+    it has been idle for a while and reopened when the next message is queued.
+
+    Parameters
+    ----------
+    transport : any
+        The transport that sends messages i.e. YagmailTransport or SMTPTransport
+
+    batch_size : int
+        The largest number of queued messages sent together.
+        Defaults to 20
+
+    idle_timeout : float
+        The number of seconds the session is kept open without any messages to send.
+        Defaults to 60
+    """
+    def __init__(self,
+                 transport,
+                 batch_size: int = 20,
+                 idle_timeout: float = 60):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        # Each message is [to address, subject, contents, attachments, future for whether it was sent]
+        self.messages = deque()
+        self.condition = threading.Condition()
+        self.sender_thread = None
+        # A transport waiting to replace the current one once no batch is being sent
+        self.next_transport = None
+        self.is_open = False
+        self.stopping = False
+        self.handshakes = 0
+        self.batches = 0
+        self.sent = 0
+        self.failed = 0
+        self.sending_seconds = 0
+
+    def set_transport(self, transport):
+        """
+        Replaces the transport i.e. with a local SMTP stand-in. A batch being sent is finished over the current
+        session first, so the sender thread closes it and makes the swap before sending the next batch
+
+        Parameters
+        ----------
+        transport : any
+            The new transport
+        """
+        with self.condition:
+            if self.sender_thread is None or not self.sender_thread.is_alive():
+                # No batch can be in flight
+                self.next_transport = None
+                self.swap_transport(transport)
+            else:
+                self.next_transport = transport
+                self.condition.notify()
+
+    def swap_transport(self, transport):
+        """
+        Closes the current session and starts using a new transport. Must be called whilst holding the condition
+        and when no batch is being sent
+
+        Parameters
+        ----------
+        transport : any
+            The new transport
+        """
+        if self.is_open:
+            self.transport.close()
+            self.is_open = False
+        self.transport = transport
+
+    def send(self,
+             to_address: str,
+             subject: str = "",
+             contents: str = "",
+             attachments: list = None):
+        """
+        Queues a message to be sent
+
+        Parameters
+        ----------
+        to_address : str
+            The email address of the recipient
+
+        subject : str
+            The title of the email
+
+        contents : str
+            The text contained within the email
+
+        attachments : list
+            The file names of attachments to be sent
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to whether the message was sent
+        """
+        future = Future()
+        with self.condition:
+            self.messages.append([to_address, subject, contents, attachments, future])
+            self.stopping = False
+            if self.sender_thread is None or not self.sender_thread.is_alive():
+                self.sender_thread = threading.Thread(target=self.work, daemon=True)
+                self.sender_thread.start()
+            self.condition.notify()
+        return future
+
+    def send_message(self, message: list):
+        """
+        Sends one message over the session, reconnecting once if the session has dropped
+
+        Parameters
+        ----------
+        message : list
+            The queued message
+
+        Returns
+        -------
+        bool
+            Whether the message was sent
+        """
+        for attempt in range(2):
+            try:
+                if not self.is_open:
+                    self.transport.open()
+                    self.is_open = True
+                    self.handshakes += 1
+                self.transport.send(*message[:4])
+                return True
+            except Exception:
+                # The session may have expired, so start a new one
+                try:
+                    self.transport.close()
+                except Exception:
+                    pass
+                self.is_open = False
+        return False
+
+    def work(self):
+        """
+        Sends queued messages in batches until the outbox is stopped
+        """
+        while True:
+            with self.condition:
+                if not self.messages and not self.stopping and self.next_transport is None:
+                    self.condition.wait(self.idle_timeout)
+                if self.next_transport is not None:
+                    self.swap_transport(self.next_transport)
+                    self.next_transport = None
+                if not self.messages:
+                    # Idle for too long or stopping, so end the session
+                    if self.is_open:
+                        self.transport.close()
+                        self.is_open = False
+                    if self.stopping:
+                        return
+                    continue
+                batch = [self.messages.popleft() for _ in range(min(self.batch_size, len(self.messages)))]
+            start_time = time.perf_counter()
+            for message in batch:
+                was_sent = self.send_message(message)
+                self.sent += was_sent
+                self.failed += not was_sent
+                message[4].set_result(was_sent)
+            self.sending_seconds += time.perf_counter() - start_time
+            self.batches += 1
+
+    def stop(self, timeout: float = 10):
+        """
+        Sends any queued messages and then ends the session
+
+        Parameters
+        ----------
+        timeout : float
+            The number of seconds to wait for the queued messages.
+            Defaults to 10
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.sender_thread is not None:
+            self.sender_thread.join(timeout)
+        with self.condition:
+            # Make any swap the sender thread did not get to
+            if self.next_transport is not None and (self.sender_thread is None or not self.sender_thread.is_alive()):
+                self.swap_transport(self.next_transport)
+                self.next_transport = None
+
+    def get_stats(self):
+        """
+        Gets how many messages have been sent and how quickly
+
+        Returns
+        -------
+        dict
+            "sent", "failed", "batches" and "handshakes" count those events,
+            "messages_per_second" is the rate messages were sent at whilst sending
+        """
+        return {"sent": self.sent,
+                "failed": self.failed,
+                "batches": self.batches,
+                "handshakes": self.handshakes,
+                "messages_per_second": self.sent / self.sending_seconds if self.sending_seconds else 0}
+
+
+outbox = Outbox(YagmailTransport())
+
+
 def send_email(to_address: str,
                subject: str = "",
                body_text: str = "",
-               attachments: list = None):
+               attachments: list = None,
+               timeout: float = 120,
+               wait: bool = True):
     """
-    Sends an email
+    Sends an email through the outbox, by default waiting until it has been sent.
+    Callers that do not wait let the outbox send their messages together in one batch
 
     Parameters
     ----------
@@ -1417,25 +2629,26 @@ def send_email(to_address: str,
     attachments : list
         A list containing file names of attachments to be sent
 
+    timeout : float
+        The number of seconds to wait for the email to be sent.
+        Defaults to 120
+
+    wait : bool
+        Whether to wait for the email to be sent.
+        Defaults to True
+
     Returns
     -------
-    bool
-        Whether the email was successfully sent
+    bool | concurrent.futures.Future
+        Whether the email was successfully sent, or if not waiting, a future that resolves to it
     """
-    st = timeit.default_timer()
+    email_body = f"{body_text}\n\nFrom the Turtle Tennis team."
+    email_sent = outbox.send(to_address, subject, email_body, attachments)
+    if not wait:
+        return email_sent
     try:
-        # Use oauth2 .JSON file and associated company email to connect to the client
-        yag = yagmail.SMTP("turtletennisgear@gmail.com", oauth2_file="oauth2-credits.json")
-        email_body = f"{body_text}\n\nFrom the Turtle Tennis team."
-        yag.send(to=to_address,
-                 subject=subject,
-                 contents=email_body,
-                 attachments=attachments)
-        print(timeit.default_timer() - st)
-        return True
-    # If no internet connection
-    except TimeoutError and socket.gaierror:
-        print(timeit.default_timer() - st)
+        return email_sent.result(timeout)
+    except FutureTimeoutError:
         return False
 
 
@@ -1503,27 +2716,29 @@ def create_best_selling_report(days_back: int):
     pdf.set_text_color(r=0, g=0, b=0)
     pdf.cell(w=40, txt=f"{timeframe}", align="R")
 
-    all_products = crud.search_table("ecommerce",
-                                     "Product",
-                                     ["*"],
-                                     "")
+    all_products = crud.iter_table("ecommerce",
+                                   "Product",
+                                   ["*"],
+                                   {})
+    # Get the units sold for every product in one query
+    total_sold_per_product = get_total_sold_per_product(days_back)
     dataset = []
     for product in all_products:
         # Create dataset per product
         product_dataset = {}
         product_id = product.get("product_id")
+        total_sold = total_sold_per_product.get(product_id, 0)
         # Add name, units sold, profit generated to the dataset
         product_dataset["name"] = product.get("name")
-        product_dataset["units_sold"] = get_total_sold(product_id, days_back)
+        product_dataset["units_sold"] = total_sold
         # Profit generated = (total sold * price) - (total sold * cost)
-        total_sold = get_total_sold(product_id, days_back)
         product_dataset["profit_generated"] = (total_sold * product.get("sale_price") - (total_sold * product.get("order_cost")))
         # Add the product dataset to the overall one
         dataset.append(product_dataset)
 
     # If less than the maximum of 5 products exist
-    if len(all_products) < 5:
-        ending_index = len(all_products) + 1
+    if len(dataset) < 5:
+        ending_index = len(dataset) + 1
     else:
         ending_index = 6
     top_five_products_by_units = sort_products_by(dataset, field_name="units_sold", is_desc=True)[0:ending_index]
@@ -1605,14 +2820,16 @@ def try_login(username: str,
     account_matched = crud.search_table("ecommerce",
                                         "Customer",
                                         ["*"],
-                                        f"username = '{encrypt('username', username)}' AND password = '{encrypt('password', password)}'")
+                                        {"username": username,
+                                         "password": password})
     if account_matched:
         return ["Customer", account_matched[0]]
     else:
         account_matched = crud.search_table("ecommerce",
                                             "Staff",
                                             ["*"],
-                                            f"username = '{encrypt('username', username)}' AND password = '{encrypt('password', password)}'")
+                                            {"username": username,
+                                             "password": password})
         if account_matched:
             return ["Staff", account_matched[0]]
         else:
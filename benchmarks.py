@@ -0,0 +1,721 @@
+from contextlib import contextmanager
+import os
+import random
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+import timeit
+
+import backend
+import crud_functionality as crud
+import migrations
+import users
+
+# The cipher using the original key, which the original algorithms are compared against
+cipher = backend.keyring.get_cipher(1)
+
+
+def legacy_encrypt(decrypted_field: str, plaintext_key: str = "pepsi_max"):
+    """
+    The original encryption algorithm, which rebuilds the Vigenere table on every call.
+    Kept to check that the cipher produces the same ciphertext
+
+    Parameters
+    ----------
+    decrypted_field : str
+        The field to encrypt
+
+    plaintext_key : str
+        The key used to encrypt.
+        Defaults to the application's key
+
+    Returns
+    -------
+    str
+        The encrypted field
+    """
+    key_ascii_values = [ord(character) for character in plaintext_key]
+    table_range = [integer for integer in range(32, 127)]
+    vigenere_table = [table_range[i:] + table_range[:i] for i in range(len(table_range))]
+
+    key_pointer = 0
+    encrypted_field = ""
+    for character in decrypted_field:
+        row = ord(character) - 32
+        column = key_ascii_values[key_pointer] - 32
+        encrypted_field += chr(vigenere_table[row][column])
+        if key_pointer + 1 > len(key_ascii_values) - 1:
+            key_pointer = 0
+        else:
+            key_pointer += 1
+    return encrypted_field
+
+
+def legacy_decrypt(encrypted_field: str, plaintext_key: str = "pepsi_max"):
+    """
+    The original decryption algorithm, which searches every row of the Vigenere table for every character.
+    Kept to check that the cipher produces the same plaintext
+
+    Parameters
+    ----------
+    encrypted_field : str
+        The field to decrypt
+
+    plaintext_key : str
+        The key used to decrypt.
+        Defaults to the application's key
+
+    Returns
+    -------
+    str
+        The decrypted field
+    """
+    key_ascii_values = [ord(character) for character in plaintext_key]
+    table_range = [integer for integer in range(32, 127)]
+    vigenere_table = [table_range[i:] + table_range[:i] for i in range(len(table_range))]
+
+    key_pointer = 0
+    decrypted_field = ""
+    for character in str(encrypted_field):
+        column = key_ascii_values[key_pointer] - 32
+        row = [row for row in vigenere_table if row[column] == ord(character)]
+        decrypted_field += chr(row[0][0])
+        if key_pointer + 1 > len(key_ascii_values) - 1:
+            key_pointer = 0
+        else:
+            key_pointer += 1
+    return decrypted_field
+
+
+def get_sample_fields(sample_size: int):
+    """
+    Gets text to encrypt, made up of every text field in the database followed by random printable strings
+
+    Parameters
+    ----------
+    sample_size : int
+        The number of random strings to add
+
+    Returns
+    -------
+    list
+        The sample strings
+    """
+    conn, cur = crud.open_database("ecommerce")
+    samples = []
+    table_names = [row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    for table_name in table_names:
+        for row in cur.execute(f"SELECT * FROM {table_name}"):
+            samples += [field for field in row if isinstance(field, str)]
+
+    printable_characters = [chr(code) for code in range(32, 127)]
+    random_generator = random.Random(0)
+    for _ in range(sample_size):
+        samples.append("".join(random_generator.choices(printable_characters, k=random_generator.randint(0, 40))))
+    return samples
+
+
+def check_cipher_compatibility(samples: list):
+    """
+    Checks that the cipher gives exactly the same ciphertext and plaintext as the original algorithm
+
+    Parameters
+    ----------
+    samples : list
+        The strings to check
+
+    Returns
+    -------
+    list
+        The samples that gave different results, which should be empty
+    """
+    mismatches = []
+    for sample in samples:
+        legacy_ciphertext = legacy_encrypt(sample)
+        if (cipher.encrypt(sample) != legacy_ciphertext
+                or cipher.decrypt(legacy_ciphertext) != legacy_decrypt(legacy_ciphertext)
+                or cipher.decrypt(legacy_ciphertext) != sample):
+            mismatches.append(sample)
+    return mismatches
+
+
+def benchmark_cipher(sample_size: int = 2000, repeats: int = 3):
+    """
+    Times the original algorithm against the cipher on the same strings and displays the results in the console
+
+    Parameters
+    ----------
+    sample_size : int
+        The number of random strings to add to the database's text fields.
+        Defaults to 2000
+
+    repeats : int
+        The number of times each timing is repeated, of which the fastest is kept.
+        Defaults to 3
+
+    Returns
+    -------
+    dict
+        Keys state the operation.
+        Values state [original seconds, cipher seconds]
+    """
+    samples = get_sample_fields(sample_size)
+    ciphertexts = [legacy_encrypt(sample) for sample in samples]
+    mismatches = check_cipher_compatibility(samples)
+
+    timings = {"encrypt": [min(timeit.repeat(lambda: [legacy_encrypt(sample) for sample in samples], number=1, repeat=repeats)),
+                           min(timeit.repeat(lambda: [cipher.encrypt(sample) for sample in samples], number=1, repeat=repeats))],
+               "decrypt": [min(timeit.repeat(lambda: [legacy_decrypt(text) for text in ciphertexts], number=1, repeat=repeats)),
+                           min(timeit.repeat(lambda: [cipher.decrypt(text) for text in ciphertexts], number=1, repeat=repeats))]}
+
+    print(f"CIPHER BENCHMARK ({len(samples)} fields, {sum(len(sample) for sample in samples)} characters)")
+    for operation, [original_time, cipher_time] in timings.items():
+        print(f"    {operation}: original {original_time:.4f}s, cipher {cipher_time:.4f}s, "
+              f"{original_time / cipher_time:.1f}x faster")
+    if mismatches:
+        print(f"    INCOMPATIBLE: {len(mismatches)} fields differ i.e. {mismatches[0]!r}")
+    else:
+        print("    Compatible: every field gives the same ciphertext and plaintext")
+    return timings
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP to accept messages, counting the sessions and messages received
+    """
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.sessions += 1
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO") or command.startswith("HELO"):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                # Read the message up to the line holding a single full stop
+                while self.rfile.readline() not in [b".\r\n", b".\n", b""]:
+                    pass
+                self.server.messages += 1
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    A local stand-in for Gmail's SMTP server, used to benchmark sending emails without sending any
+
+    Parameters
+    ----------
+    port : int
+        The port to listen on, or 0 for any free port.
+        Defaults to 0
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(("localhost", port), LocalSMTPHandler)
+        self.sessions = 0
+        self.messages = 0
+
+    def start(self):
+        """
+        Starts accepting connections in the background
+
+        Returns
+        -------
+        int
+            The port being listened on
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+
+def benchmark_email(message_count: int = 200, batch_size: int = 20):
+    """
+    Times sending emails with a new session per message, as send_email used to, against the outbox
+    reusing one session, both through a local SMTP stand-in, and displays the results in the console
+
+    Parameters
+    ----------
+    message_count : int
+        The number of emails to send each way.
+        Defaults to 200
+
+    batch_size : int
+        The largest number of messages the outbox sends together.
+        Defaults to 20
+
+    Returns
+    -------
+    dict
+        Keys state the approach.
+        Values state [messages per second, sessions opened]
+    """
+    server = LocalSMTPServer()
+    port = server.start()
+    messages = [[f"customer{count}@example.com", "Your order receipt", f"Receipt number {count}", None]
+                for count in range(message_count)]
+
+    # A new session for every message
+    start_time = time.perf_counter()
+    for message in messages:
+        transport = backend.SMTPTransport(port=port)
+        transport.open()
+        transport.send(*message)
+        transport.close()
+    per_message_seconds = time.perf_counter() - start_time
+    per_message_sessions = server.sessions
+
+    # One session shared through the outbox
+    outbox = backend.Outbox(backend.SMTPTransport(port=port), batch_size=batch_size)
+    start_time = time.perf_counter()
+    futures = [outbox.send(*message) for message in messages]
+    all_sent = all(future.result() for future in futures)
+    outbox_seconds = time.perf_counter() - start_time
+    outbox.stop()
+    server.shutdown()
+    server.server_close()
+
+    results = {"session per message": [message_count / per_message_seconds, per_message_sessions],
+               "outbox": [message_count / outbox_seconds, outbox.get_stats().get("handshakes")]}
+    print(f"EMAIL BENCHMARK ({message_count} messages, local SMTP stand-in)")
+    for approach, [messages_per_second, sessions] in results.items():
+        print(f"    {approach}: {messages_per_second:.0f} messages/s, {sessions} sessions opened")
+    if not all_sent or server.messages != message_count * 2:
+        print(f"    INCOMPLETE: the stand-in received {server.messages} of {message_count * 2} messages")
+    return results
+
+
+@contextmanager
+def working_copy():
+    """
+    Runs the code inside it on a temporary copy of the database, its encryption settings and the fonts
+    used by reports, so that benchmarks which write do not change the application's data
+
+    Returns
+    -------
+    str
+        The temporary directory, which is the working directory until the code inside finishes
+    """
+    original_directory = os.getcwd()
+    crud.close_all_connections()
+    with tempfile.TemporaryDirectory() as directory:
+        for file_name in os.listdir(original_directory):
+            if file_name in ["ecommerce.db", "encryption_status.txt", "encryption_keys.txt"] or file_name.endswith(".ttf"):
+                shutil.copy(file_name, directory)
+        os.chdir(directory)
+        # Cached records belong to the original database
+        crud.query_cache.clear()
+        try:
+            # The copy may not have been migrated yet
+            migrations.run_migrations("ecommerce")
+            yield directory
+        finally:
+            crud.close_all_connections()
+            crud.query_cache.clear()
+            os.chdir(original_directory)
+
+
+def legacy_checkout(product_id: int, quantity: int):
+    """
+    The original way stock was taken, reading the stock and then writing it back reduced in separate statements.
+    Kept to show that concurrent checkouts can oversell or lose updates
+
+    Parameters
+    ----------
+    product_id : int
+        The ID of the product
+
+    quantity : int
+        The quantity to take
+
+    Returns
+    -------
+    bool
+        Whether the stock was taken, which is False once it looks sold out
+    """
+    conn, cur = crud.open_database("ecommerce")
+    current_stock = cur.execute("SELECT current_stock FROM Product WHERE product_id = ?", [product_id]).fetchone()[0]
+    if current_stock < quantity:
+        return False
+    cur.execute("UPDATE Product SET current_stock = ? WHERE product_id = ?", [current_stock - quantity, product_id])
+    conn.commit()
+    return True
+
+
+def benchmark_checkout(thread_count: int = 8, stock: int = 200):
+    """
+    Runs concurrent checkouts of one product until it sells out, first taking stock the original way and then
+    through process_order, and displays the throughput and whether any stock was oversold in the console.
+    Runs on a temporary copy of the database so that the application's data is not changed
+
+    Parameters
+    ----------
+    thread_count : int
+        The number of checkouts running at once.
+        Defaults to 8
+
+    stock : int
+        The stock the product starts with, bought one at a time.
+        Defaults to 200
+
+    Returns
+    -------
+    dict
+        Keys state the approach.
+        Values state [checkouts per second, successful checkouts, final stock]
+    """
+    with working_copy():
+        conn, cur = crud.open_database("ecommerce")
+        customer_id, payment_card_id = cur.execute("SELECT customer_id, payment_card_id FROM Payment_Card LIMIT 1").fetchone()
+        product = crud.search_table("ecommerce", "Product", ["*"], {})[0]
+
+        def run_checkouts(checkout):
+            cur.execute("UPDATE Product SET current_stock = ? WHERE product_id = ?", [stock, product.get("product_id")])
+            conn.commit()
+            crud.query_cache.clear()
+            successes = []
+
+            def work():
+                while checkout():
+                    successes.append(1)
+                crud.close_thread_connections()
+
+            threads = [threading.Thread(target=work) for _ in range(thread_count)]
+            start_time = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start_time
+            final_stock = cur.execute("SELECT current_stock FROM Product WHERE product_id = ?", [product.get("product_id")]).fetchone()[0]
+            return [len(successes) / seconds, len(successes), final_stock]
+
+        def reserved_checkout():
+            customer = users.Customer({"customer_id": customer_id})
+            customer.get_basket().add(dict(product, quantity=1))
+            try:
+                backend.process_order(customer,
+                                      {"payment_card_id": payment_card_id},
+                                      False,
+                                      {"delivery_address": "1 Benchmark Road", "delivery_postcode": "BT1 1AA"})
+            except backend.InsufficientStockError:
+                return False
+            return True
+
+        results = {"read then write": run_checkouts(lambda: legacy_checkout(product.get("product_id"), 1)),
+                   "process_order with reservation": run_checkouts(reserved_checkout)}
+
+    print(f"CHECKOUT BENCHMARK ({thread_count} threads buying {stock} in stock one at a time)")
+    for approach, [checkouts_per_second, successes, final_stock] in results.items():
+        # Every successful checkout should have taken exactly one from the stock
+        lost_updates = successes - (stock - final_stock)
+        print(f"    {approach}: {checkouts_per_second:.0f} checkouts/s, {successes} succeeded, final stock {final_stock}, "
+              f"{max(successes - stock, 0)} oversold, {lost_updates} lost updates")
+    return results
+
+
+class StageTimer:
+    """
+    Records how long each stage of placing an order takes, by wrapping the backend functions that carry them out
+    """
+    def __init__(self):
+        # Keys are stage names and values are lists of the durations recorded, in seconds
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        """
+        Records a duration for a stage
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+
+        seconds : float
+            How long the stage took
+        """
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def wrap(self, function, stage: str):
+        """
+        Wraps a function so that every call to it is recorded as a stage
+
+        Parameters
+        ----------
+        function : function
+            The function to time
+
+        stage : str
+            The name of the stage
+
+        Returns
+        -------
+        function
+            The timed function
+        """
+        def timed_function(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start_time)
+        return timed_function
+
+    def get_total(self, stage: str):
+        """
+        Gets the total time spent in a stage
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+
+        Returns
+        -------
+        float
+            The total number of seconds
+        """
+        with self.lock:
+            return sum(self.durations.get(stage, []))
+
+
+def get_percentile(values: list, percentile: float):
+    """
+    Gets a percentile of a set of values using the nearest rank
+
+    Parameters
+    ----------
+    values : list
+        The values, which must not be empty
+
+    percentile : float
+        The percentile to get i.e. 95
+
+    Returns
+    -------
+    float
+        The value at that percentile
+    """
+    sorted_values = sorted(values)
+    rank = max(1, round(percentile / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def seed_load_test(customer_count: int, stock: int):
+    """
+    Adds customers with a payment card each and gives every product enough stock for the load test,
+    clearing any jobs that were copied with the database
+
+    Parameters
+    ----------
+    customer_count : int
+        The number of customers to add
+
+    stock : int
+        The stock given to every product
+
+    Returns
+    -------
+    list
+        For each customer, [a dictionary of the customer's details, the ID of their payment card]
+    """
+    customer_details = [{"username": f"loadtest{count}",
+                         "password": "Password1",
+                         "name": "Load",
+                         "surname": f"Tester{count}",
+                         "email_address": f"loadtest{count}@example.com"}
+                        for count in range(customer_count)]
+    with crud.transaction("ecommerce") as tx:
+        customer_ids = crud.add_records("ecommerce", "Customer", customer_details)
+        payment_card_ids = crud.add_records("ecommerce",
+                                            "Payment_Card",
+                                            [{"card_number": f"4000 0000 0000 {count:04d}",
+                                              "cvc": "123",
+                                              "expiry_date": "12/30",
+                                              "cardholder_name": f"Load Tester{count}",
+                                              "billing_address": "1 Benchmark Road",
+                                              "billing_postcode": "BT1 1AA",
+                                              "customer_id": customer_id}
+                                             for count, customer_id in enumerate(customer_ids)])
+        tx.cursor.execute("UPDATE Product SET current_stock = ?", [stock])
+        tx.cursor.execute("DELETE FROM Jobs")
+        crud.record_writes("ecommerce", {"Product", "Jobs"})
+    return [[dict(details, customer_id=customer_id), payment_card_id]
+            for details, customer_id, payment_card_id in zip(customer_details, customer_ids, payment_card_ids)]
+
+
+def benchmark_order_load(customer_count: int = 8,
+                         orders_per_customer: int = 25,
+                         send_receipts: bool = True,
+                         real_receipts: bool = False,
+                         email_transport=None,
+                         receipt_timeout: float = 120,
+                         seed: int = 0):
+    """
+    Simulates customers placing orders at the same time through process_order, each with a basket of 1 to 3
+    random products, and displays the throughput, latency percentiles and time spent in each stage in the console.
+    Runs on a temporary copy of the database so that the application's data is not changed
+
+    Parameters
+    ----------
+    customer_count : int
+        The number of customers placing orders at once.
+        Defaults to 8
+
+    orders_per_customer : int
+        The number of orders each customer places, one after another.
+        Defaults to 25
+
+    send_receipts : bool
+        Whether the receipt jobs should be run and waited for.
+        Defaults to True
+
+    real_receipts : bool
+        Whether receipt PDFs should be generated, rather than attaching a placeholder file.
+        Defaults to False
+
+    email_transport : any
+        The transport receipts are emailed through i.e. backend.YagmailTransport() to send them for real.
+        Defaults to None, which uses a local SMTP stand-in
+
+    receipt_timeout : float
+        The longest number of seconds to wait for the receipts after the orders are placed.
+        Defaults to 120
+
+    seed : int
+        The seed for choosing the products in each basket.
+        Defaults to 0
+
+    Returns
+    -------
+    dict
+        "orders_per_second", the latency percentiles "p50", "p95" and "p99" in seconds,
+        "stages" mapping each stage to its mean seconds per order and "receipts" as [sent, failed, seconds taken]
+    """
+    timer = StageTimer()
+    original_functions = {function_name: getattr(backend, function_name)
+                          for function_name in ["reserve_stock", "create_receipt"]}
+    original_transport = backend.outbox.transport
+    server = None
+    with working_copy() as directory:
+        customers = seed_load_test(customer_count, stock=customer_count * orders_per_customer * 10)
+        products = crud.search_table("ecommerce", "Product", ["*"], {})
+
+        if real_receipts:
+            create_receipt = original_functions.get("create_receipt")
+        else:
+            placeholder_file = os.path.join(directory, "receipt.pdf")
+            with open(placeholder_file, "wb") as placeholder:
+                placeholder.write(b"%PDF-1.4\n%%EOF\n")
+
+            def create_receipt(order_id: int, full_name: str):
+                return placeholder_file
+        if email_transport is None:
+            server = LocalSMTPServer()
+            email_transport = backend.SMTPTransport(port=server.start())
+
+        # Time each stage wherever it is called from, including the receipt jobs.
+        # Receipt jobs do not wait for their emails, so the email stage is the outbox's time spent sending
+        backend.reserve_stock = timer.wrap(original_functions.get("reserve_stock"), "stock")
+        backend.create_receipt = timer.wrap(create_receipt, "receipt")
+        backend.outbox.set_transport(email_transport)
+        outbox_stats = backend.outbox.get_stats()
+        sending_seconds = backend.outbox.sending_seconds
+        try:
+            if send_receipts:
+                backend.get_job_queue().start()
+            latencies = []
+
+            def place_orders(customer_details: dict, payment_card_id: int, random_generator: random.Random):
+                customer = users.Customer(customer_details)
+                for _ in range(orders_per_customer):
+                    basket = customer.get_basket()
+                    for product in random_generator.sample(products, k=random_generator.randint(1, 3)):
+                        basket.add(dict(product, quantity=random_generator.randint(1, 3)))
+                    basket.update_subtotal()
+                    start_time = time.perf_counter()
+                    backend.process_order(customer,
+                                          {"payment_card_id": payment_card_id},
+                                          False,
+                                          {"delivery_address": "1 Benchmark Road", "delivery_postcode": "BT1 1AA"})
+                    latencies.append(time.perf_counter() - start_time)
+                crud.close_thread_connections()
+
+            threads = [threading.Thread(target=place_orders, args=(customer_details, payment_card_id, random.Random(seed + count)))
+                       for count, [customer_details, payment_card_id] in enumerate(customers)]
+            start_time = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            order_seconds = time.perf_counter() - start_time
+
+            conn, cur = crud.open_database("ecommerce")
+            if send_receipts:
+                # Wait for every receipt job to be sent or to fail
+                while (cur.execute("SELECT COUNT(*) FROM Jobs WHERE status IN ('Pending', 'Running')").fetchone()[0]
+                       and time.perf_counter() - start_time < receipt_timeout):
+                    time.sleep(0.05)
+            receipt_seconds = time.perf_counter() - start_time
+            receipts_sent = cur.execute("SELECT COUNT(*) FROM Jobs WHERE status = 'Done'").fetchone()[0]
+            receipts_failed = cur.execute("SELECT COUNT(*) FROM Jobs WHERE status = 'Failed'").fetchone()[0]
+            email_seconds = backend.outbox.sending_seconds - sending_seconds
+            email_batches = backend.outbox.get_stats().get("batches") - outbox_stats.get("batches")
+        finally:
+            backend.get_job_queue().stop()
+            for function_name, function in original_functions.items():
+                setattr(backend, function_name, function)
+            # Send anything still queued through the benchmark's transport before restoring the original
+            backend.outbox.stop()
+            backend.outbox.set_transport(original_transport)
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    order_count = len(latencies)
+    stock_seconds = timer.get_total("stock")
+    results = {"orders_per_second": order_count / order_seconds,
+               "p50": get_percentile(latencies, 50),
+               "p95": get_percentile(latencies, 95),
+               "p99": get_percentile(latencies, 99),
+               # The database stage is the rest of process_order once the stock has been taken
+               "stages": {"database": (sum(latencies) - stock_seconds) / order_count,
+                          "stock": stock_seconds / order_count,
+                          "receipt": timer.get_total("receipt") / order_count,
+                          "email": email_seconds / order_count},
+               "receipts": [receipts_sent, receipts_failed, receipt_seconds]}
+
+    print(f"ORDER LOAD BENCHMARK ({customer_count} customers placing {orders_per_customer} orders each, "
+          f"{'generated' if real_receipts else 'placeholder'} receipts)")
+    print(f"    throughput: {results.get('orders_per_second'):.0f} orders/s")
+    print(f"    latency: p50 {results.get('p50') * 1000:.1f}ms, p95 {results.get('p95') * 1000:.1f}ms, "
+          f"p99 {results.get('p99') * 1000:.1f}ms")
+    print("    stages (mean per order): " + ", ".join(f"{stage} {seconds * 1000:.1f}ms"
+                                                     for stage, seconds in results.get("stages").items()))
+    if send_receipts:
+        print(f"    receipts: {receipts_sent} sent and {receipts_failed} failed within {receipt_seconds:.2f}s of the first order, "
+              f"emailed in {email_batches} batches")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_cipher()
+    benchmark_email()
+    benchmark_checkout()
+    benchmark_order_load()
@@ -1,7 +1,834 @@
+import atexit
+from collections import OrderedDict
 import os
+import re
 import sqlite3
+import threading
+import time
 
 import backend
+import migrations
+
+
+class ConnectionPool:
+    """
+    Data structure that keeps one long-lived connection per thread for each database, so
+    that crud functions do not pay the cost of connecting and configuring on every call
+
+    Parameters
+    ----------
+    max_connections : int
+        The maximum number of connections that may be open at once.
+        Defaults to 16
+
+    wait_timeout : float
+        The number of seconds a thread will wait for a free slot when the pool is full.
+        Defaults to 10
+    """
+    def __init__(self,
+                 max_connections: int = 16,
+                 wait_timeout: float = 10):
+        self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
+        # Keys are (database name, thread ident) and values are sqlite3.Connection objects
+        self.connections = {}
+        # Keys are (database name, thread ident) and values are how many transactions are open on that connection
+        self.transaction_depths = {}
+        # Keys are (database name, thread ident) and values are the tables written by the open transaction
+        self.written_tables = {}
+        # The (database name, thread ident) pairs of connections that must be checked before they are reused
+        self.failed_connections = set()
+        self.condition = threading.Condition()
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    def get_connection(self, database_name: str):
+        """
+        Gets the calling thread's connection to a database, opening one if needed
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database to connect to
+
+        Returns
+        -------
+        sqlite3.Connection
+            A healthy connection owned by the calling thread
+        """
+        key = (database_name, threading.get_ident())
+        with self.condition:
+            conn = self.connections.get(key)
+            check_needed = key in self.failed_connections
+        if conn is not None:
+            # Connections are only checked after a statement on them has failed.
+            # A connection inside a transaction must be reused as-is so that the transaction is not lost
+            if not check_needed or self.get_transaction_depth(database_name):
+                with self.condition:
+                    self.reused += 1
+                return conn
+            if self.is_healthy(database_name, conn):
+                with self.condition:
+                    self.failed_connections.discard(key)
+                    self.reused += 1
+                return conn
+            self.discard(key)
+
+        # Recover database if it cannot be found
+        if not os.path.exists(f"{database_name}.db"):
+            recover_database(database_name)
+            # Recovery migrates the database through this thread's connection, which is reused rather than replaced
+            with self.condition:
+                conn = self.connections.get(key)
+            if conn is not None:
+                return conn
+
+        with self.condition:
+            deadline = time.monotonic() + self.wait_timeout
+            while len(self.connections) >= self.max_connections:
+                self.prune_dead_threads()
+                if len(self.connections) < self.max_connections:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(f"Connection pool is full ({self.max_connections} connections)")
+                # Poll as threads can finish without releasing their connections
+                self.condition.wait(min(remaining, 0.05))
+            # Connections are only used by the thread that owns them but may be closed by another on shutdown
+            # Statements are parameterised, so a larger cache lets more compiled plans be reused
+            conn = sqlite3.connect(f"{database_name}.db", check_same_thread=False, cached_statements=256)
+            # Enable foreign keys
+            conn.execute("PRAGMA foreign_keys = ON")
+            self.connections[key] = conn
+            self.opened += 1
+        return conn
+
+    def is_healthy(self, database_name: str, conn: sqlite3.Connection):
+        """
+        Checks whether a pooled connection that a statement failed on can still be used
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database the connection belongs to
+
+        conn : sqlite3.Connection
+            The pooled connection
+
+        Returns
+        -------
+        bool
+            True if the connection is usable and False if it should be replaced
+        """
+        # A deleted database file must go through recovery rather than reuse the stale handle
+        if not os.path.exists(f"{database_name}.db"):
+            return False
+        try:
+            # Discard any work left uncommitted by a statement that failed part-way
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def discard(self, key: tuple):
+        """
+        Closes and removes a single connection from the pool
+
+        Parameters
+        ----------
+        key : tuple
+            The (database name, thread ident) pair identifying the connection
+        """
+        with self.condition:
+            conn = self.connections.pop(key, None)
+            self.transaction_depths.pop(key, None)
+            self.written_tables.pop(key, None)
+            self.failed_connections.discard(key)
+            if conn is not None:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                self.closed += 1
+                self.condition.notify_all()
+
+    def prune_dead_threads(self):
+        """
+        Closes the connections of any threads that have finished
+        """
+        live_idents = {thread.ident for thread in threading.enumerate()}
+        for key in [key for key in self.connections if key[1] not in live_idents]:
+            self.discard(key)
+
+    def close_thread_connections(self):
+        """
+        Closes every connection owned by the calling thread
+        """
+        ident = threading.get_ident()
+        with self.condition:
+            for key in [key for key in self.connections if key[1] == ident]:
+                self.discard(key)
+
+    def close_all(self):
+        """
+        Closes every connection in the pool i.e. on shutdown
+        """
+        with self.condition:
+            for key in list(self.connections):
+                self.discard(key)
+
+    def get_transaction_depth(self, database_name: str):
+        """
+        Gets how many transactions the calling thread has open on a database
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+
+        Returns
+        -------
+        int
+            0 if no transaction is open, 1 for a transaction and more for each nested savepoint
+        """
+        with self.condition:
+            return self.transaction_depths.get((database_name, threading.get_ident()), 0)
+
+    def set_transaction_depth(self, database_name: str, depth: int):
+        """
+        Records how many transactions the calling thread has open on a database
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+
+        depth : int
+            The number of open transactions and savepoints
+        """
+        with self.condition:
+            self.transaction_depths[(database_name, threading.get_ident())] = depth
+
+    def mark_failed(self, database_name: str):
+        """
+        Records that a statement failed on the calling thread's connection, so that it is checked before it is reused
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+        """
+        with self.condition:
+            self.failed_connections.add((database_name, threading.get_ident()))
+
+    def add_written_tables(self, database_name: str, table_names):
+        """
+        Records tables written by the calling thread's open transaction
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+
+        table_names : list | set
+            The names of the tables that have been written
+        """
+        with self.condition:
+            self.written_tables.setdefault((database_name, threading.get_ident()), set()).update(table_names)
+
+    def pop_written_tables(self, database_name: str):
+        """
+        Gets and forgets the tables written by the calling thread's transaction once it has ended
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+
+        Returns
+        -------
+        set
+            The names of the tables that were written
+        """
+        with self.condition:
+            return self.written_tables.pop((database_name, threading.get_ident()), set())
+
+    def get_stats(self):
+        """
+        Gets the pool's usage counters
+
+        Returns
+        -------
+        dict
+            The number of connections opened, reused, closed and currently active
+        """
+        with self.condition:
+            return {"opened": self.opened,
+                    "reused": self.reused,
+                    "closed": self.closed,
+                    "active": len(self.connections)}
+
+
+connection_pool = ConnectionPool()
+# Ensure pooled connections are closed when the application exits
+atexit.register(connection_pool.close_all)
+
+
+class Transaction:
+    """
+    Context manager for a unit of work that groups any number of crud calls into one transaction.
+    Crud functions called inside it join the transaction instead of committing on their own.
+    Changes are committed once when the outermost transaction ends and rolled back if an
+    exception is raised. Nested transactions use savepoints, so an inner failure only
+    undoes the inner work.
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+    """
+    def __init__(self, database_name: str):
+        self.database_name = database_name
+        self.conn = None
+        self.cursor = None
+        self.savepoint_name = None
+
+    def __enter__(self):
+        self.conn, self.cursor = open_database(self.database_name)
+        depth = connection_pool.get_transaction_depth(self.database_name)
+        if depth == 0:
+            # Take the write lock immediately to avoid deadlocking with another writer part-way through
+            self.cursor.execute("BEGIN IMMEDIATE")
+        else:
+            self.savepoint_name = f"unit_of_work_{depth}"
+            self.cursor.execute(f"SAVEPOINT {self.savepoint_name}")
+        connection_pool.set_transaction_depth(self.database_name, depth + 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        depth = connection_pool.get_transaction_depth(self.database_name) - 1
+        connection_pool.set_transaction_depth(self.database_name, depth)
+        if self.savepoint_name is None:
+            written_tables = connection_pool.pop_written_tables(self.database_name)
+            if exc_type is None:
+                try:
+                    self.conn.commit()
+                except sqlite3.Error:
+                    # End the transaction so that the next crud call on this connection does not commit it
+                    try:
+                        self.conn.rollback()
+                    except sqlite3.Error:
+                        pass
+                    connection_pool.mark_failed(self.database_name)
+                    if written_tables:
+                        query_cache.invalidate(self.database_name, written_tables)
+                    raise
+                # Other threads may have cached records read before the changes were committed
+                if written_tables:
+                    query_cache.invalidate(self.database_name, written_tables)
+            else:
+                # Nothing was committed, so records cached by other threads are still correct
+                self.conn.rollback()
+                if issubclass(exc_type, sqlite3.Error):
+                    connection_pool.mark_failed(self.database_name)
+        else:
+            if exc_type is not None:
+                self.cursor.execute(f"ROLLBACK TO {self.savepoint_name}")
+            self.cursor.execute(f"RELEASE {self.savepoint_name}")
+        # Do not suppress any exception
+        return False
+
+
+class SchemaCatalog:
+    """
+    Data structure that caches the column metadata of each table so that field names
+    can be looked up without querying the table itself
+    """
+    def __init__(self):
+        # Keys are (database name, table name) and values are the table's schema dictionaries
+        self.schemas = {}
+        # Keys are database names and values map each table to the tables whose foreign keys reference it
+        self.references = {}
+        # Keys are database names and values map each table to the tables its triggers write to
+        self.trigger_targets = {}
+        self.lock = threading.Lock()
+
+    def get_schema(self, database_name: str, table_name: str):
+        """
+        Gets the column names, column types and primary key of a table, loading them on first use
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database which holds the table
+
+        table_name : str
+            The name of the table
+
+        Returns
+        -------
+        dict
+            The table's schema.
+            "columns" holds the column names in table order,
+            "types" maps each column name to its declared type,
+            "primary_key" holds the name of the primary key column and
+            "blind_indexes" maps each field that has a blind index to its blind index column
+        """
+        key = (database_name, table_name)
+        with self.lock:
+            schema = self.schemas.get(key)
+        if schema is None:
+            schema = self.load_schema(database_name, table_name)
+            with self.lock:
+                self.schemas[key] = schema
+        return schema
+
+    def load_schema(self, database_name: str, table_name: str):
+        """
+        Reads a table's schema from the database
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database which holds the table
+
+        table_name : str
+            The name of the table
+
+        Returns
+        -------
+        dict
+            The table's schema in the format returned by get_schema
+        """
+        conn, cur = open_database(database_name)
+        # Each row is (cid, name, type, notnull, default value, pk)
+        table_info = cur.execute(f"PRAGMA table_info({table_name})").fetchall()
+        if not table_info:
+            raise sqlite3.OperationalError(f"no such table: {table_name}")
+        primary_keys = [column[1] for column in table_info if column[5]]
+        column_names = tuple(column[1] for column in table_info)
+        return {"columns": column_names,
+                "types": {column[1]: column[2] for column in table_info},
+                "primary_key": primary_keys[0] if primary_keys else None,
+                "blind_indexes": {column_name: backend.get_blind_index_column(column_name) for column_name in column_names
+                                  if backend.get_blind_index_column(column_name) in column_names}}
+
+    def load_dependencies(self, database_name: str):
+        """
+        Reads which tables reference each table through foreign keys and which tables each table's triggers write to
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+
+        Returns
+        -------
+        list
+            The references and trigger targets, each a dictionary mapping a table name to a set of table names
+        """
+        with self.lock:
+            references = self.references.get(database_name)
+            trigger_targets = self.trigger_targets.get(database_name)
+        if references is None or trigger_targets is None:
+            conn, cur = open_database(database_name)
+            references = {}
+            table_names = [row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            for child_table in table_names:
+                # Each row is (id, seq, parent table, from, to, on update, on delete, match)
+                for foreign_key in cur.execute(f"PRAGMA foreign_key_list({child_table})").fetchall():
+                    references.setdefault(foreign_key[2], set()).add(child_table)
+            trigger_targets = {}
+            for table_name, trigger_sql in cur.execute("SELECT tbl_name, sql FROM sqlite_master WHERE type = 'trigger'"):
+                # Only the statements in the trigger's body write to tables
+                trigger_body = re.split(r"\bBEGIN\b", trigger_sql, maxsplit=1, flags=re.IGNORECASE)[-1]
+                for target_table in re.findall(r"\b(?:UPDATE|INSERT\s+(?:OR\s+\w+\s+)?INTO|DELETE\s+FROM)\s+(\w+)",
+                                               trigger_body, flags=re.IGNORECASE):
+                    trigger_targets.setdefault(table_name, set()).add(target_table)
+            with self.lock:
+                self.references[database_name] = references
+                self.trigger_targets[database_name] = trigger_targets
+        return [references, trigger_targets]
+
+    def get_affected_tables(self, database_name: str, table_name: str, include_cascades: bool = True):
+        """
+        Gets every other table whose records may be changed when a table's records are written,
+        following triggers and, for updates and deletes, foreign key cascades through any number of tables
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database which holds the table
+
+        table_name : str
+            The name of the table
+
+        include_cascades : bool
+            Whether foreign key cascades should be followed, which only happen on updates and deletes.
+            Defaults to True
+
+        Returns
+        -------
+        set
+            The names of the tables that may be changed
+        """
+        references, trigger_targets = self.load_dependencies(database_name)
+        affected_tables = set()
+        tables_to_check = [table_name]
+        while tables_to_check:
+            current_table = tables_to_check.pop()
+            next_tables = trigger_targets.get(current_table, set())
+            if include_cascades:
+                next_tables = next_tables | references.get(current_table, set())
+            for next_table in next_tables:
+                if next_table not in affected_tables and next_table != table_name:
+                    affected_tables.add(next_table)
+                    tables_to_check.append(next_table)
+        return affected_tables
+
+    def invalidate(self, database_name: str, table_name: str = None):
+        """
+        Forgets cached schemas so that they are reloaded on next use
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database whose schemas have changed
+
+        table_name : str
+            The name of the table whose schema has changed.
+            Defaults to None, which invalidates every table in the database
+        """
+        with self.lock:
+            for key in list(self.schemas):
+                if key[0] == database_name and (table_name is None or key[1] == table_name):
+                    del self.schemas[key]
+            # Any change may add or remove a foreign key or trigger
+            self.references.pop(database_name, None)
+            self.trigger_targets.pop(database_name, None)
+
+
+schema_catalog = SchemaCatalog()
+
+
+class QueryCache:
+    """
+    Data structure that keeps the decrypted results of recent searches so that repeated
+    reads do not query and decrypt the same records again. The least recently used result
+    is evicted when the cache is full. Every table has a version number that is increased
+    whenever its records are written, so results read from an older version are never returned.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of search results kept at once.
+        Defaults to 256
+
+    max_records_per_entry : int
+        The maximum number of records a search may return for its result to be kept.
+        Defaults to 5000
+    """
+    def __init__(self,
+                 max_entries: int = 256,
+                 max_records_per_entry: int = 5000):
+        self.max_entries = max_entries
+        self.max_records_per_entry = max_records_per_entry
+        # Keys are normalised queries and values are [table versions when read, records]
+        self.entries = OrderedDict()
+        # Keys are (database name, table name) and values are the number of times the table has been written
+        self.table_versions = {}
+        # Keys are database names and values are increased when every table in the database may have changed
+        self.database_versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    @staticmethod
+    def make_key(*query_parts):
+        """
+        Converts the parts of a query into a hashable key, so that queries which differ only in the
+        order of their conditions share a key
+
+        Parameters
+        ----------
+        *query_parts
+            The database name, encryption status, tables, scope and search parameters of the query
+
+        Returns
+        -------
+        tuple
+            The normalised query
+        """
+        def normalise(value):
+            if isinstance(value, dict):
+                return tuple(sorted((str(key), normalise(item)) for key, item in value.items()))
+            if isinstance(value, set):
+                return tuple(sorted(normalise(item) for item in value))
+            if isinstance(value, (list, tuple)):
+                return tuple(normalise(item) for item in value)
+            return value
+        return normalise(query_parts)
+
+    def get_versions(self, database_name: str, table_names: list):
+        """
+        Gets the current versions of the tables that a query reads
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+
+        table_names : list
+            The names of the tables read by the query
+
+        Returns
+        -------
+        tuple
+            The database version followed by each table's version
+        """
+        with self.lock:
+            return (self.database_versions.get(database_name, 0),) + tuple(
+                self.table_versions.get((database_name, table_name), 0) for table_name in table_names)
+
+    def get(self, key: tuple, versions: tuple):
+        """
+        Gets a copy of a cached result if it was read from the current versions of its tables
+
+        Parameters
+        ----------
+        key : tuple
+            The normalised query
+
+        versions : tuple
+            The current versions of the tables read by the query
+
+        Returns
+        -------
+        list | None
+            The records, or None if the result is not cached
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != versions:
+                # One of the tables has been written since the result was read
+                del self.entries[key]
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            records = entry[1]
+        # Copy the records so that callers cannot alter the cached result
+        return [record.copy() for record in records]
+
+    def put(self, key: tuple, versions: tuple, records: list):
+        """
+        Caches a copy of a result, evicting the least recently used results if the cache is full
+
+        Parameters
+        ----------
+        key : tuple
+            The normalised query
+
+        versions : tuple
+            The versions of the tables read by the query, taken before it was run
+
+        records : list
+            The records returned by the query
+        """
+        if len(records) > self.max_records_per_entry:
+            return
+        records = [record.copy() for record in records]
+        with self.lock:
+            self.entries[key] = [versions, records]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, database_name: str, table_names=None):
+        """
+        Increases the version of tables that have been written so that results read from them are no longer returned
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the database
+
+        table_names : list | set
+            The names of the tables that have been written.
+            Defaults to None, which invalidates every table in the database
+        """
+        with self.lock:
+            if table_names is None:
+                self.database_versions[database_name] = self.database_versions.get(database_name, 0) + 1
+            else:
+                for table_name in table_names:
+                    key = (database_name, table_name)
+                    self.table_versions[key] = self.table_versions.get(key, 0) + 1
+
+    def clear(self):
+        """
+        Removes every cached result
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        """
+        Gets the cache's usage counters
+
+        Returns
+        -------
+        dict
+            The number of hits, misses, evictions, stale results dropped and results currently cached
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "stale": self.stale,
+                    "entries": len(self.entries)}
+
+
+query_cache = QueryCache()
+# Searches on these fields are never cached, so that credentials are not kept in memory as part of a cache key
+uncached_fields = frozenset(["password"])
+
+
+class RowFactory:
+    """
+    Converts the rows of a query into decrypted dictionaries, using key names and a decryption plan
+    worked out once from the cursor description rather than from extra queries.
+    Only the columns holding encrypted fields are decrypted, a whole column of a batch at a time.
+    Where a field name appears more than once (i.e. customer_id in a join of Orders and Payment_Card),
+    the unqualified key holds the first table's value and every copy is also given a
+    table-qualified key i.e. "Payment_Card.customer_id".
+    Scope fields written as "table.field" keep their qualified key and scope fields written as
+    "field AS alias" are keyed by their alias.
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database the query was run on
+
+    cursor_description : tuple
+        The description of the cursor that ran the query
+
+    scope_of_record : list
+        The fields that were selected by the query
+
+    table_names : list
+        The names of the tables in the query in the order they were joined
+    """
+    def __init__(self,
+                 database_name: str,
+                 cursor_description: tuple,
+                 scope_of_record: list,
+                 table_names: list):
+        column_names = [description[0] for description in cursor_description]
+        # The table each column came from (if known) and the field used to decide whether to decrypt it
+        owners = [None] * len(column_names)
+        # Whether each column was selected as "table.field" without an alias
+        qualified_scope_fields = [False] * len(column_names)
+        self.source_fields = list(column_names)
+        if scope_of_record[0] == "*":
+            # Only look up table ownership when field names clash as it comes from the cached schema
+            if len(set(column_names)) != len(column_names):
+                table_owners = []
+                for table_name in table_names:
+                    table_owners += [table_name] * len(get_table_schema(database_name, table_name).get("columns"))
+                if len(table_owners) == len(column_names):
+                    owners = table_owners
+        else:
+            for count, scope_field in enumerate(scope_of_record):
+                # Matches "field", "table.field" and either with " AS alias"
+                match = re.fullmatch(r"\s*(?:(\w+)\.)?(\w+)(?:\s+AS\s+(\w+))?\s*", scope_field, re.IGNORECASE)
+                if match:
+                    owners[count] = match.group(1)
+                    self.source_fields[count] = match.group(2)
+                    qualified_scope_fields[count] = bool(match.group(1)) and not match.group(3)
+
+        # Work out the keys that each column's value will be stored under
+        self.keys_per_column = []
+        keys_taken = set()
+        for count, column_name in enumerate(column_names):
+            keys = []
+            if scope_of_record[0] == "*" and column_name in backend.internal_columns:
+                # Internal columns i.e. blind indexes are left out of records
+                self.keys_per_column.append(keys)
+                continue
+            if column_name not in keys_taken:
+                keys.append(column_name)
+            if owners[count] and (column_names.count(column_name) > 1 or qualified_scope_fields[count]):
+                keys.append(f"{owners[count]}.{column_name}")
+            if not keys:
+                # Fall back to the column's position so that no value is lost
+                keys.append(f"{column_name}_{count}")
+            keys_taken.update(keys)
+            self.keys_per_column.append(keys)
+
+        # Every row is built from a copy of this dictionary so that its size is allocated once
+        self.template = dict.fromkeys(key for keys in self.keys_per_column for key in keys)
+        # The positions of the columns that hold ciphertext when encryption is enabled
+        self.encrypted_columns = [count for count, source_field in enumerate(self.source_fields)
+                                  if backend.is_encrypted_field(source_field)]
+
+    def convert(self, row: tuple):
+        """
+        Converts a row into a dictionary of decrypted field values
+
+        Parameters
+        ----------
+        row : tuple
+            The row returned by the query
+
+        Returns
+        -------
+        dict
+            Keys state the field names.
+            Values state the decrypted field values
+        """
+        return self.convert_batch([row])[0]
+
+    def convert_batch(self, rows: list):
+        """
+        Converts a batch of rows into dictionaries of decrypted field values
+
+        Parameters
+        ----------
+        rows : list
+            The rows returned by the query
+
+        Returns
+        -------
+        list
+            A dictionary for each row.
+            Keys state the field names.
+            Values state the decrypted field values
+        """
+        if self.encrypted_columns and rows and backend.get_should_encrypt():
+            # Decrypt column by column so that plaintext columns are never visited
+            columns = list(zip(*rows))
+            for count in self.encrypted_columns:
+                columns[count] = [value if value is None else backend.keyring.decrypt(str(value)) for value in columns[count]]
+            rows = zip(*columns)
+
+        records = []
+        for row in rows:
+            record = self.template.copy()
+            for keys, value in zip(self.keys_per_column, row):
+                for key in keys:
+                    record[key] = value
+            records.append(record)
+        return records
 
 
 def create_recovery_database():
@@ -35,17 +862,18 @@ def create_recovery_database():
                  access_level char(10) NOT NULL""",
                  None)
 
-    add_record("ecommerce",
-               "Staff",
-               {"username": "management",
-                "password": "Tt123",
-                "name": "Calum",
-                "surname": "Fitzpatrick",
-                "address": "30 Egg Fields",
-                "postcode": "BT65 7YD",
-                "weekly_hours": "30",
-                "email_address": "turtletennisgear@gmail.com",
-                "access_level": "Management"})
+    # Seed records are inserted together in one transaction
+    add_records("ecommerce",
+                "Staff",
+                [{"username": "management",
+                  "password": "Tt123",
+                  "name": "Calum",
+                  "surname": "Fitzpatrick",
+                  "address": "30 Egg Fields",
+                  "postcode": "BT65 7YD",
+                  "weekly_hours": "30",
+                  "email_address": "turtletennisgear@gmail.com",
+                  "access_level": "Management"}])
 
     # Payment card table
     create_table("ecommerce",
@@ -144,11 +972,15 @@ def recover_database(database_name: str):
             backup_file_name, _ = backend.get_recent_backup(database_name)
             # Copy backup into new database file
             os.system(f"copy backups\\{backup_file_name} {database_name}.db")
+        # The restored file may not match the cached schema
+        invalidate_schema(database_name)
+        # Bring the recovered database up to the current schema version
+        migrations.run_migrations(database_name)
 
 
 def open_database(database_name: str):
     """
-    Function used to open and connect to a SQLite3 database.
+    Function used to get the calling thread's pooled connection to a SQLite3 database.
 
     Parameters
     ------------
@@ -166,16 +998,125 @@ def open_database(database_name: str):
         A cursor object that allows the program to execute provided SQL statements
         on the database found in the "database_name.db" file.
     """
-    # Recover database if it cannot be found
-    if not os.path.exists(f"{database_name}.db"):
-        recover_database(database_name)
-    conn = sqlite3.connect(f"{database_name}.db")
-    # Enable foreign keys
-    conn.execute("PRAGMA foreign_keys = ON")
+    conn = connection_pool.get_connection(database_name)
     cur = conn.cursor()
     return [conn, cur]
 
 
+def transaction(database_name: str):
+    """
+    Starts a unit of work that crud calls will join i.e.
+    with crud.transaction("ecommerce") as tx: ...
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    Returns
+    -------
+    Transaction
+        The context manager for the unit of work
+    """
+    return Transaction(database_name)
+
+
+def commit_unless_in_transaction(database_name: str,
+                                 conn: sqlite3.Connection):
+    """
+    Commits a crud call's changes unless it is part of a unit of work, which will commit them instead
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    conn : sqlite3.Connection
+        The connection the changes were made on
+    """
+    if not connection_pool.get_transaction_depth(database_name):
+        conn.commit()
+
+
+def rollback_unless_in_transaction(database_name: str,
+                                   conn: sqlite3.Connection):
+    """
+    Rolls back a failed crud call's changes unless it is part of a unit of work, which will roll them back instead.
+    The connection is checked before it is next reused
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    conn : sqlite3.Connection
+        The connection the changes were made on
+    """
+    connection_pool.mark_failed(database_name)
+    if not connection_pool.get_transaction_depth(database_name):
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass
+
+
+def record_writes(database_name: str,
+                  table_names):
+    """
+    Invalidates cached results read from tables that have been written. Inside a unit of work the tables
+    are invalidated again when it commits, as other threads can still read and cache the committed records until then
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    table_names : list | set
+        The names of the tables that have been written
+    """
+    query_cache.invalidate(database_name, table_names)
+    if connection_pool.get_transaction_depth(database_name):
+        connection_pool.add_written_tables(database_name, table_names)
+
+
+def get_connection_stats():
+    """
+    Gets the number of connections opened, reused, closed and currently active
+
+    Returns
+    -------
+    dict
+        The connection pool's usage counters
+    """
+    return connection_pool.get_stats()
+
+
+def get_query_cache_stats():
+    """
+    Gets the number of cache hits, misses, evictions and stale results dropped
+
+    Returns
+    -------
+    dict
+        The query cache's usage counters
+    """
+    return query_cache.get_stats()
+
+
+def close_thread_connections():
+    """
+    Closes the calling thread's pooled connections i.e. when a worker thread finishes
+    """
+    connection_pool.close_thread_connections()
+
+
+def close_all_connections():
+    """
+    Closes every pooled connection i.e. when the application shuts down
+    """
+    connection_pool.close_all()
+
+
 def create_table(database_name: str,
                  table_name: str,
                  fields_string: str,
@@ -214,8 +1155,116 @@ def create_table(database_name: str,
 
     print(create_command)
     cur.execute(f"{create_command});")
-    conn.commit()
-    conn.close()
+    commit_unless_in_transaction(database_name, conn)
+    schema_catalog.invalidate(database_name, table_name)
+
+
+def get_blind_indexes(database_name: str,
+                      table_names: list):
+    """
+    Gets the blind index columns of the tables in a query, so that conditions on their fields can use them
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database which holds the tables
+
+    table_names : list
+        The names of the tables in the query
+
+    Returns
+    -------
+    dict
+        Keys state the field name, both on its own and table-qualified i.e. "username" and "Customer.username".
+        Values state the blind index column, qualified in the same way
+    """
+    blind_indexes = {}
+    for table_name in reversed(table_names):
+        # The first table's field takes the unqualified name, as in search results
+        for field_name, column_name in get_table_schema(database_name, table_name).get("blind_indexes").items():
+            blind_indexes[field_name] = column_name
+            blind_indexes[f"{table_name}.{field_name}"] = f"{table_name}.{column_name}"
+    return blind_indexes
+
+
+def build_conditions(conditions,
+                     blind_indexes: dict = None):
+    """
+    Converts structured search conditions into a parameterised SQL condition string so that
+    SQLite can reuse the compiled statement whenever the same shape of query is run.
+    Values are encrypted to match the stored format of their field.
+    Equality conditions on fields with a blind index are matched against the indexed blind index instead.
+
+    Parameters
+    ----------
+    conditions : dict | str
+        The conditions that records must satisfy. All conditions are joined by AND.
+        Keys should state the field name, which may be table-qualified i.e. "Orders.customer_id".
+        Values should state either:
+            - A single value: the field must equal the value
+            - A list, tuple or set: the field must equal one of the values
+            - A dictionary of operators and values i.e. {">=": start, "<=": end}.
+              Operators may be =, !=, <, <=, >, >=, IN or NOT IN
+            - None: the field must be null
+        A string is treated as a pre-written SQL condition with no values to bind.
+        Null conditions should be passed as {} or ""
+
+    blind_indexes : dict
+        The blind index columns returned by get_blind_indexes.
+        Defaults to None, which compares every field directly
+
+    Returns
+    -------
+    list
+        The SQL condition string (without the WHERE keyword) and the list of values to bind to it
+    """
+    if isinstance(conditions, str):
+        return [conditions, []]
+
+    clauses = []
+    values = []
+    for field_name, condition in conditions.items():
+        # Table-qualified fields are encrypted according to their column name
+        column_name = field_name.split(".")[-1]
+        if condition is None:
+            clauses.append(f"{field_name} IS NULL")
+            continue
+        if isinstance(condition, dict):
+            operators_and_values = condition.items()
+        elif isinstance(condition, (list, tuple, set)):
+            operators_and_values = [["IN", condition]]
+        else:
+            operators_and_values = [["=", condition]]
+
+        for operator, value in operators_and_values:
+            operator = operator.upper()
+            if blind_indexes and field_name in blind_indexes and operator in ["=", "IN"]:
+                if operator == "IN":
+                    placeholders = ", ".join("?" for _ in value)
+                    clauses.append(f"{blind_indexes[field_name]} IN ({placeholders})")
+                    values += [backend.get_blind_index(item) for item in value]
+                else:
+                    clauses.append(f"{blind_indexes[field_name]} = ?")
+                    values.append(backend.get_blind_index(value))
+            elif operator in ["IN", "NOT IN"]:
+                # Match every stored form of each value
+                stored_values = [stored_value for item in value for stored_value in backend.get_search_ciphertexts(column_name, item)]
+                placeholders = ", ".join("?" for _ in stored_values)
+                clauses.append(f"{field_name} {operator} ({placeholders})")
+                values += stored_values
+            elif operator in ["=", "!="] and len(backend.get_search_ciphertexts(column_name, value)) > 1:
+                # The value may be stored encrypted with either key whilst the key is being rotated
+                stored_values = backend.get_search_ciphertexts(column_name, value)
+                placeholders = ", ".join("?" for _ in stored_values)
+                clauses.append(f"{field_name} {'IN' if operator == '=' else 'NOT IN'} ({placeholders})")
+                values += stored_values
+            elif operator in ["=", "!=", "<", "<=", ">", ">="]:
+                clauses.append(f"{field_name} {operator} ?")
+                values.append(backend.encrypt(column_name, value))
+            else:
+                raise ValueError(f"Unsupported operator '{operator}' for field '{field_name}'")
+
+    return [" AND ".join(clauses), values]
 
 
 def add_record(database_name: str,
@@ -234,29 +1283,123 @@ def add_record(database_name: str,
 
     non_pk_values : dict
         The values of all non primary-key fields in the record to be added.
+
+    Returns
+    ------------
+    int
+        The ID of the record that was added.
+    """
+    return add_records(database_name, table_name, [non_pk_values])[0]
+
+
+def add_records(database_name: str,
+                table_name: str,
+                non_pk_values_list: list):
+    """
+    Function used to add any number of new records to a table in a single transaction.
+
+    Parameters
+    ------------
+    database_name : str
+        The name of the database that holds the correct table.
+
+    table_name : str
+        The name of the table to add the records to.
+
+    non_pk_values_list : list
+        A list of dictionaries, each holding the values of all non primary-key fields
+        in a record to be added.
+
+    Returns
+    ------------
+    list
+        The IDs of the records that were added, in the same order as non_pk_values_list.
     """
+    if not non_pk_values_list:
+        return []
     conn, cur = open_database(database_name)
 
     field_names = get_table_headings(database_name, table_name)[1:]
-    values_in_order = []
-    for field in field_names:
-        # Enforce encryption
-        decrypted_field = str(non_pk_values[field])
-        encrypted_field = backend.encrypt(field, decrypted_field)
-        values_in_order.append(encrypted_field)
+    blind_indexes = get_table_schema(database_name, table_name).get("blind_indexes")
+    rows = []
+    for non_pk_values in non_pk_values_list:
+        values_in_order = []
+        for field in field_names:
+            # Enforce encryption
+            decrypted_field = str(non_pk_values[field])
+            encrypted_field = backend.encrypt(field, decrypted_field)
+            values_in_order.append(encrypted_field)
+        # Maintain the blind indexes of the record
+        values_in_order += [backend.get_blind_index(non_pk_values[field]) for field in blind_indexes]
+        rows.append(values_in_order)
+
+    # Conjoin the non-primary key fields and their placeholders with a comma between each
+    field_names = field_names + list(blind_indexes.values())
+    fields = ", ".join(field_names)
+    placeholders = ", ".join("?" for _ in field_names)
+    try:
+        # Note: ID is not included as SQL will auto-increment it
+        cur.executemany(f"INSERT INTO {table_name} ({fields}) VALUES ({placeholders});", rows)
+        # The write lock is held until commit, so the new IDs are consecutive and end at the last one inserted
+        last_id = cur.execute("SELECT last_insert_rowid();").fetchone()[0]
+        commit_unless_in_transaction(database_name, conn)
+    except sqlite3.Error:
+        rollback_unless_in_transaction(database_name, conn)
+        raise
+    # Triggers may write to other tables
+    record_writes(database_name, {table_name} | schema_catalog.get_affected_tables(database_name, table_name, include_cascades=False))
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def build_join(starting_table: str,
+               table_and_links: list):
+    """
+    Builds the FROM clause for a chain of joined tables
+
+    Parameters
+    ----------
+    starting_table : str
+        The name of the first table in the chain.
+
+    table_and_links : list
+        A two-dimensional list representing a chain of tables that connect in order.
+        The list should be written as:
+        [ [table_1_name, table_1_id], [table_2_name, table_2_id]... ] where table_1 connects to table_2 and so on.
+
+    Returns
+    -------
+    str
+        The tables and join conditions (without the FROM keyword)
+    """
+    # Set the first table in the join chain to the starting table
+    join_string = starting_table
 
-    # Conjoin the non-primary key values with a comma between each value
-    values = "', '".join(values_in_order)
-    # Note: ID is not included as SQL will auto-increment it
-    cur.execute(f"INSERT INTO {table_name} VALUES (NULL, '{values}');")
-    conn.commit()
-    conn.close()
+    previous_table_name = None
+    # Iterate through the table chain
+    for count, table in enumerate(table_and_links):
+        current_table_name = table[0]
+        current_table_id = table[1]
+        table_to_join = current_table_name
+        # If the table is joining to the original table
+        if count == 0:
+            table_to_join_to = starting_table
+        else:
+            # The table joins to the previous table in the chain
+            table_to_join_to = previous_table_name
+        joining_id = current_table_id
+        # Set the previous table as the current table
+        previous_table_name = current_table_name
+        # Add SQL syntax
+        join_string += f""" INNER JOIN {table_to_join}
+                              ON {table_to_join_to}.{joining_id}
+                              = {table_to_join}.{joining_id}"""
+    return join_string
 
 
 def search_table(database_name: str,
                  table_name: str,
                  scope_of_record: list,
-                 search_parameters: str):
+                 search_parameters: dict):
     """
     Function used to search and return specific fields from records that match predefined criteria.
 
@@ -273,50 +1416,60 @@ def search_table(database_name: str,
         elements will be of type str.
 
     search_parameters : dict
-        The SQL conditions that specify which records should be returned.
-        Must be in the form "fieldName = 'value' OPERATOR ..."
-        Null search parameters should be passed as ""
+        The conditions that specify which records should be returned.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
+        Null search parameters should be passed as {}
 
     Returns
     ------------
     list
-        A list of tuples containing the required fields from records that match
+        A list of dictionaries containing the required fields from records that match
         the search criteria.
     """
-    
-    conn, cur = open_database(database_name)
-    # Conjoin the scope fields with a comma between each field
-    scope = ", ".join(scope_of_record)
-    search_command = f"SELECT {scope} FROM {table_name}"
+    return search_joined_table(database_name, table_name, [], scope_of_record, search_parameters)
 
-    # If there are search parameters present i.e, the user does not want to return the whole table
-    if search_parameters != "":
-        search_command += f" WHERE {search_parameters}"
 
-    cur.execute(f"{search_command};")
-    # Return required fields from records that match the search criteria
-    rows = cur.fetchall()
+def iter_table(database_name: str,
+               table_name: str,
+               scope_of_record: list,
+               search_parameters: dict,
+               chunk_size: int = 500):
+    """
+    Generator version of search_table that fetches and decrypts records in chunks, so that
+    only one chunk of a large table is held in memory at a time.
 
-    # Format results into a dictionary that removes the need for indexes
-    if scope_of_record[0] == "*":
-        field_names = get_table_headings(database_name, table_name)
-    else:
-        field_names = scope_of_record
-        
-    results = []
-    for row in rows:
-        # Enforce decryption
-        results.append({field_names[count]: backend.decrypt(field_names[count], field)
-                        for count, field in enumerate(row)})
+    Parameters
+    ------------
+    database_name : str
+        The name of the database that holds the correct table.
+
+    table_name : str
+        The name of the table to search in.
+
+    scope_of_record : list
+        The fields that should be returned from records that match the search criteria.
 
-    return results
+    search_parameters : dict
+        The conditions that specify which records should be returned.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
+
+    chunk_size : int
+        The number of rows fetched from the database at a time.
+        Defaults to 500
+
+    Yields
+    ------------
+    dict
+        The required fields of each record that matches the search criteria.
+    """
+    return iter_joined_table(database_name, table_name, [], scope_of_record, search_parameters, chunk_size)
 
 
 def search_joined_table(database_name: str,
                         starting_table: str,
                         table_and_links: list,
                         scope_of_record: list,
-                        search_parameters: str):
+                        search_parameters: dict):
     """
     Function used to join tables, and then search and return specific fields from records
     that match predefined criteria in said table.
@@ -338,72 +1491,206 @@ def search_joined_table(database_name: str,
         The fields that should be returned from records that match the search criteria. All
         elements will be of type str.
 
-    search_parameters : str
-        The SQL conditions that specify which records should be returned.
-        Must be in the form "fieldName = 'value' OPERATOR ..."
-        Null search parameters should be passed as ""
+    search_parameters : dict
+        The conditions that specify which records should be returned.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
+        Null search parameters should be passed as {}
 
     Returns
     ------------
     list
-        A list of tuples containing the required fields from records that match
+        A list of dictionaries containing the required fields from records that match
         the search criteria.
     """
-        
+    # Uncommitted changes are only visible to the transaction's own thread so are never cached
+    if connection_pool.get_transaction_depth(database_name) or (
+            isinstance(search_parameters, dict)
+            and any(field_name.split(".")[-1] in uncached_fields for field_name in search_parameters)
+    ):
+        return list(iter_joined_table(database_name, starting_table, table_and_links, scope_of_record, search_parameters))
+
+    table_names = [starting_table] + [table_and_link[0] for table_and_link in table_and_links]
+    # Records are decrypted according to the encryption status, so results are cached per status
+    key = query_cache.make_key(database_name, backend.get_should_encrypt(), starting_table, table_and_links,
+                               scope_of_record, search_parameters)
+    # Versions are taken before searching so that a write made during the search makes the result stale
+    versions = query_cache.get_versions(database_name, table_names)
+    records = query_cache.get(key, versions)
+    if records is None:
+        records = list(iter_joined_table(database_name, starting_table, table_and_links, scope_of_record, search_parameters))
+        query_cache.put(key, versions, records)
+    return records
+
+
+def iter_joined_table(database_name: str,
+                      starting_table: str,
+                      table_and_links: list,
+                      scope_of_record: list,
+                      search_parameters: dict,
+                      chunk_size: int = 500):
+    """
+    Generator version of search_joined_table that fetches and decrypts records in chunks, so that
+    only one chunk of a large join is held in memory at a time.
+
+    Parameters
+    ------------
+    database_name : str
+        The name of the database that holds the correct table.
+
+    starting_table : str
+        The name of the first table in the chain.
+
+    table_and_links : list
+        A two-dimensional list representing a chain of tables that connect in order.
+        The list should be written as:
+        [ [table_1_name, table_1_id], [table_2_name, table_2_id]... ] where table_1 connects to table_2 and so on.
+
+    scope_of_record : list
+        The fields that should be returned from records that match the search criteria.
+
+    search_parameters : dict
+        The conditions that specify which records should be returned.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
+
+    chunk_size : int
+        The number of rows fetched from the database at a time.
+        Defaults to 500
+
+    Yields
+    ------------
+    dict
+        The required fields of each record that matches the search criteria.
+    """
     conn, cur = open_database(database_name)
     # Conjoin the scope fields with a comma between each field
     scope = ", ".join(scope_of_record)
-    # Set the first table in the join chain to the starting table
-    search_command = f"SELECT {scope} FROM {starting_table}"
-
-    previous_table_name = None
-    # Iterate through the table chain
-    for count, table in enumerate(table_and_links):
-        current_table_name = table[0]
-        current_table_id = table[1]
-        table_to_join = current_table_name
-        # If the table is joining to the original table
-        if count == 0:
-            table_to_join_to = starting_table
-        else:
-            # The table joins to the previous table in the chain
-            table_to_join_to = previous_table_name
-        joining_id = current_table_id
-        # Set the previous table as the current table
-        previous_table_name = current_table_name
-        # Add SQL syntax
-        search_command += f""" INNER JOIN {table_to_join}
-                              ON {table_to_join_to}.{joining_id}
-                              = {table_to_join}.{joining_id}"""
+    search_command = f"SELECT {scope} FROM {build_join(starting_table, table_and_links)}"
 
+    table_names = [starting_table] + [table_and_link[0] for table_and_link in table_and_links]
+    condition_string, condition_values = build_conditions(search_parameters, get_blind_indexes(database_name, table_names))
     # If there are search parameters present i.e, the user does not want to return the whole table
-    if search_parameters != "":
-        search_command += f" WHERE {search_parameters}"
-
-    cur.execute(f"{search_command};")
-    # Return required fields from records that match the search criteria
-    rows = cur.fetchall()
-
-    if scope_of_record[0] == "*":
-        field_names = get_table_headings(database_name, starting_table)
-        for table_and_link in table_and_links:
-            table_name = table_and_link[0]
-            field_names += get_table_headings(database_name, table_name)
+    if condition_string != "":
+        search_command += f" WHERE {condition_string}"
+
+    try:
+        cur.execute(f"{search_command};", condition_values)
+    except sqlite3.DatabaseError:
+        connection_pool.mark_failed(database_name)
+        raise
+
+    # Format results into a dictionary that removes the need for indexes
+    row_factory = RowFactory(database_name, cur.description, scope_of_record, table_names)
+
+    # Return required fields from records that match the search criteria, one chunk at a time
+    rows = cur.fetchmany(chunk_size)
+    while rows:
+        yield from row_factory.convert_batch(rows)
+        rows = cur.fetchmany(chunk_size)
+
+
+def aggregate(database_name: str,
+              table_name: str,
+              aggregations: dict,
+              search_parameters: dict = None,
+              group_by=None,
+              table_and_links: list = None):
+    """
+    Function used to calculate counts, sums, averages, minimums and maximums within SQLite
+    so that the records themselves do not have to be fetched and decrypted.
+
+    Parameters
+    ------------
+    database_name : str
+        The name of the database that holds the correct table.
+
+    table_name : str
+        The name of the table to aggregate over, or the first table in the join chain.
+
+    aggregations : dict
+        Keys state the field to aggregate, which may be table-qualified i.e. "Order_Product.quantity",
+        or "*" to count records.
+        Values state the aggregate function: "count", "sum", "avg", "min", "max" or "total".
+        "sum", "avg", "min" and "max" give None when no records match whereas "total" gives 0.0
+
+    search_parameters : dict
+        The conditions that specify which records are aggregated.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
+        Defaults to aggregating every record
+
+    group_by : str | list
+        The field, or list of fields, to group records by.
+        Defaults to aggregating all matching records together
+
+    table_and_links : list
+        The chain of tables to join to the first table, in the format accepted by search_joined_table.
+        Defaults to no join
+
+    Returns
+    ------------
+    int | float | dict
+        Without group_by, the single aggregated value, or a dictionary of aggregated values keyed by
+        field if more than one aggregation was given.
+        With group_by, a dictionary whose keys state the group's field value (or a tuple of values
+        if grouping by a list of fields) and whose values are as above for each group.
+    """
+    aggregate_functions = ["COUNT", "SUM", "AVG", "MIN", "MAX", "TOTAL"]
+    if not aggregations:
+        raise ValueError("At least one aggregation must be given")
+
+    if group_by is None:
+        group_fields = []
+    elif isinstance(group_by, str):
+        group_fields = [group_by]
     else:
-        field_names = scope_of_record
+        group_fields = list(group_by)
 
-    results = []
-    for row in rows:
-        results.append({field_names[count]: backend.decrypt(field_names[count], field)
-                        for count, field in enumerate(row)})
+    select_fields = list(group_fields)
+    for field_name, function in aggregations.items():
+        function = function.upper()
+        if function not in aggregate_functions:
+            raise ValueError(f"Unsupported aggregate function '{function}' for field '{field_name}'")
+        select_fields.append(f"{function}({field_name})")
 
-    return results
+    conn, cur = open_database(database_name)
+    aggregate_command = f"SELECT {', '.join(select_fields)} FROM {build_join(table_name, table_and_links or [])}"
+    table_names = [table_name] + [table_and_link[0] for table_and_link in table_and_links or []]
+    condition_string, condition_values = build_conditions(search_parameters or {}, get_blind_indexes(database_name, table_names))
+    if condition_string != "":
+        aggregate_command += f" WHERE {condition_string}"
+    if group_fields:
+        aggregate_command += f" GROUP BY {', '.join(group_fields)}"
+    try:
+        cur.execute(f"{aggregate_command};", condition_values)
+    except sqlite3.DatabaseError:
+        connection_pool.mark_failed(database_name)
+        raise
+
+    # Minimums and maximums of encrypted fields are stored encrypted so are decrypted by their column name
+    value_columns = [field_name.split(".")[-1] for field_name in aggregations.keys()]
+    group_columns = [field_name.split(".")[-1] for field_name in group_fields]
+
+    def format_values(values):
+        values = [backend.decrypt(value_columns[count], value) if function.upper() in ["MIN", "MAX"] else value
+                  for count, [value, function] in enumerate(zip(values, aggregations.values()))]
+        if len(values) == 1:
+            return values[0]
+        return dict(zip(aggregations.keys(), values))
+
+    if not group_fields:
+        return format_values(cur.fetchone())
+
+    groups = {}
+    for row in cur.fetchall():
+        group_values = [backend.decrypt(group_columns[count], value) for count, value in enumerate(row[:len(group_fields)])]
+        group_key = group_values[0] if len(group_values) == 1 else tuple(group_values)
+        groups[group_key] = format_values(row[len(group_fields):])
+    return groups
 
 
 def update_record(database_name: str,
                   table_name: str,
                   update_data_dict: dict,
-                  update_parameters: str,
+                  update_parameters: dict,
                   override_encryption_status: bool = False):
     """
     Function used to update a record that matches predefined criteria.
@@ -421,28 +1708,96 @@ def update_record(database_name: str,
         Keys should state the field name.
         Values should state their associated field's new value.
 
-    update_parameters : str
-        The SQL conditions that specify which records should be updated. Must be in the form
-        "fieldName = 'value' OPERATOR ..."
+    update_parameters : dict
+        The conditions that specify which records should be updated.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
     """
 
     conn, cur = open_database(database_name)
-    update_command = f"UPDATE {table_name} SET "
-
-    # Convert the dictionary of foreign key / references into the correct format and add to the command
-    for key, value in update_data_dict.items():
-        update_command += f"{key} = '{backend.encrypt(key, value, override_encryption_status)}',"
-    update_command = update_command[:-1] + f" WHERE {update_parameters}"
+    condition_string, condition_values = build_conditions(update_parameters, get_blind_indexes(database_name, [table_name]))
+    if condition_string == "":
+        raise ValueError("Update parameters must be given")
+
+    # Maintain the blind indexes of any updated fields that have them
+    blind_indexes = get_table_schema(database_name, table_name).get("blind_indexes")
+    update_data_dict = dict(update_data_dict)
+    for field_name, value in list(update_data_dict.items()):
+        if field_name in blind_indexes:
+            update_data_dict[blind_indexes[field_name]] = backend.get_blind_index(value)
+
+    # Convert the dictionary of fields and new values into the correct format and add to the command
+    assignments = ", ".join(f"{key} = ?" for key in update_data_dict.keys())
+    assignment_values = [backend.encrypt(key, value, override_encryption_status)
+                         for key, value in update_data_dict.items()]
+    update_command = f"UPDATE {table_name} SET {assignments} WHERE {condition_string}"
     print(update_command)
 
-    cur.execute(f"{update_command};")
-    conn.commit()
-    conn.close()
+    try:
+        cur.execute(f"{update_command};", assignment_values + condition_values)
+        commit_unless_in_transaction(database_name, conn)
+    except sqlite3.Error:
+        rollback_unless_in_transaction(database_name, conn)
+        raise
+    # Key changes cascade to the tables that reference this one and triggers may write to others
+    record_writes(database_name, {table_name} | schema_catalog.get_affected_tables(database_name, table_name))
+
+
+def increment_fields(database_name: str,
+                     table_name: str,
+                     increments: dict,
+                     update_parameters: dict):
+    """
+    Function used to add to numeric fields in place, so the current values never need to be read first.
+
+    Parameters
+    ------------
+    database_name : str
+        The name of the database that holds the correct table.
+
+    table_name : str
+        The name of the table to update in.
+
+    increments : dict
+        A dictionary of fields and the amounts to add to them.
+        Keys should state the field name.
+        Values should state the amount to add, which is negative to subtract.
+
+    update_parameters : dict
+        The conditions that specify which records should be updated.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
+
+    Returns
+    ------------
+    int
+        The number of records updated, which is 0 if none met the conditions.
+    """
+    # Arithmetic cannot be done on ciphertext
+    encrypted_fields = [field_name for field_name in increments if backend.is_encrypted_field(field_name)]
+    if encrypted_fields:
+        raise ValueError(f"Encrypted fields cannot be incremented: {', '.join(encrypted_fields)}")
+
+    conn, cur = open_database(database_name)
+    condition_string, condition_values = build_conditions(update_parameters, get_blind_indexes(database_name, [table_name]))
+    if condition_string == "":
+        raise ValueError("Update parameters must be given")
+
+    assignments = ", ".join(f"{field_name} = {field_name} + ?" for field_name in increments.keys())
+    try:
+        cur.execute(f"UPDATE {table_name} SET {assignments} WHERE {condition_string};",
+                    list(increments.values()) + condition_values)
+        records_updated = cur.rowcount
+        commit_unless_in_transaction(database_name, conn)
+    except sqlite3.Error:
+        rollback_unless_in_transaction(database_name, conn)
+        raise
+    # Only numeric fields change, never keys, so only triggers can write to other tables
+    record_writes(database_name, {table_name} | schema_catalog.get_affected_tables(database_name, table_name, include_cascades=False))
+    return records_updated
 
 
 def delete_record(database_name: str,
                   table_name: str,
-                  delete_parameters: str):
+                  delete_parameters: dict):
     """
     Function used to delete records that match predefined criteria.
 
@@ -454,16 +1809,24 @@ def delete_record(database_name: str,
     table_name : str
         The name of the table to search in.
 
-    delete_parameters : str
-        The SQL conditions that specify which records should be deleted. Must be in the form
-        "fieldName = value OPERATOR ..."
+    delete_parameters : dict
+        The conditions that specify which records should be deleted.
+        Must be in the format accepted by build_conditions i.e. {"fieldName": value, ...}
     """
     
     conn, cur = open_database(database_name)
+    condition_string, condition_values = build_conditions(delete_parameters, get_blind_indexes(database_name, [table_name]))
+    if condition_string == "":
+        raise ValueError("Delete parameters must be given")
     # Delete record where the conditions set are satisfied
-    cur.execute(f"DELETE FROM {table_name} WHERE {delete_parameters};")
-    conn.commit()
-    conn.close()
+    try:
+        cur.execute(f"DELETE FROM {table_name} WHERE {condition_string};", condition_values)
+        commit_unless_in_transaction(database_name, conn)
+    except sqlite3.Error:
+        rollback_unless_in_transaction(database_name, conn)
+        raise
+    # Deletes cascade to the tables that reference this one and triggers may write to others
+    record_writes(database_name, {table_name} | schema_catalog.get_affected_tables(database_name, table_name))
 
 
 def get_table_headings(database_name: str,
@@ -482,11 +1845,51 @@ def get_table_headings(database_name: str,
     Returns
     -------
     list
-        The column headings in the order they are presented in the table
+        The column headings in the order they are presented in the table, not including internal columns i.e. blind indexes
     """
-    conn, cur = open_database(database_name)
-    cur.execute(f"SELECT * FROM {table_name}")
-    return [description[0] for description in cur.description]
+    schema = schema_catalog.get_schema(database_name, table_name)
+    return [column_name for column_name in schema.get("columns") if column_name not in backend.internal_columns]
+
+
+def get_table_schema(database_name: str,
+                     table_name: str):
+    """
+    Gets the cached column names, column types and primary key of a table
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database which holds the correct table
+
+    table_name : str
+        The name of the table whose schema is required
+
+    Returns
+    -------
+    dict
+        "columns" holds the column names in table order,
+        "types" maps each column name to its declared type and
+        "primary_key" holds the name of the primary key column
+    """
+    return schema_catalog.get_schema(database_name, table_name)
+
+
+def invalidate_schema(database_name: str,
+                      table_name: str = None):
+    """
+    Discards cached schema metadata and search results i.e. after a table has been altered
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database whose schema has changed
+
+    table_name : str
+        The name of the table that has changed.
+        Defaults to None, which discards every table in the database
+    """
+    schema_catalog.invalidate(database_name, table_name)
+    query_cache.invalidate(database_name, None if table_name is None else [table_name])
 
 
 def get_max_length(field_name: str):
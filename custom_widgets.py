@@ -1889,14 +1889,14 @@ class Treeview(ttk.Treeview):
         for record in self.get_children():
             self.delete(record)
         
-    def populate_tree(self, records: dict):
+    def populate_tree(self, records):
         """
         Populates a treeview with a set of records
 
         Parameters
         ----------
-        records : tuple
-            A tuple whose elements consist of lists of field values
+        records : list | generator
+            An iterable of dictionaries of field values, each
             corresponding to a record
         """
         # Clear the treeview
@@ -3413,7 +3413,7 @@ class RatingBar(Frame):
         current_score = crud.search_table("ecommerce",
                                           "Product",
                                           "*",
-                                          f"product_id = '{self.linked_product_id}'")[0].get("average_rating")
+                                          {"product_id": self.linked_product_id})[0].get("average_rating")
         ratings_count = backend.count_ratings(self.linked_product_id)
         self.score_label.configure(text=f"Average rating: {current_score} ({ratings_count})")
 
@@ -3429,14 +3429,14 @@ class RatingBar(Frame):
         existing_rating = crud.search_table("ecommerce",
                                             "Ratings",
                                             ["score"],
-                                            f"customer_id = '{self.customer_id}' AND product_id = '{self.linked_product_id}'")
+                                            {"customer_id": self.customer_id, "product_id": self.linked_product_id})
         date = datetime.today().strftime('%Y-%m-%d')
         if existing_rating:
             crud.update_record("ecommerce",
                                "Ratings",
                                {"score": new_score,
                                 "date": date},
-                               f"customer_id = '{self.customer_id}' AND product_id = '{self.linked_product_id}'")
+                               {"customer_id": self.customer_id, "product_id": self.linked_product_id})
         # If no record exists, add a new one
         else:
             crud.add_record("ecommerce",
@@ -3445,14 +3445,13 @@ class RatingBar(Frame):
                              "date": date,
                              "customer_id": self.customer_id,
                              "product_id": self.linked_product_id})
-        backend.update_product_rating(self.linked_product_id)
+        # The product's average rating is updated by the Ratings triggers
         self.display_rating(new_score)
 
     def delete_rating(self):
         crud.delete_record("ecommerce",
                            "Ratings",
-                           f"customer_id = '{self.customer_id}' AND product_id = '{self.linked_product_id}'")
-        backend.update_product_rating(self.linked_product_id)
+                           {"customer_id": self.customer_id, "product_id": self.linked_product_id})
         # Display a user rating of 0 i.e. N/A
         self.display_rating(0)
 
@@ -3463,7 +3462,7 @@ class RatingBar(Frame):
         existing_rating = crud.search_table("ecommerce",
                                             "Ratings",
                                             ["score"],
-                                            f"customer_id = '{self.customer_id}' AND product_id = '{self.linked_product_id}'")
+                                            {"customer_id": self.customer_id, "product_id": self.linked_product_id})
         if existing_rating:
             self.display_rating(existing_rating[0].get("score"))
         else:
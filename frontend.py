@@ -1,9 +1,11 @@
 # Built-in libraries
 import _tkinter
+import os
 import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox as mbox
+from tkinter import simpledialog
 from tkinter.filedialog import askopenfilename
 import time
 import timeit
@@ -66,6 +68,17 @@ class RootWindow(ctk.CTk):
                                          font=("Inter Regular", 32))
         subheading_label.grid(row=1, column=0, sticky="N")
 
+        def display_reencryption_progress(rows_done, total_rows):
+            subheading_label.configure(text=f"Updating encryption: {round(rows_done / total_rows * 100)}%")
+            # Redraw the loading message as the main loop has not started yet
+            self.update()
+
+        # Encrypt or decrypt the database if the encryption status has changed, spreading the work over the CPU's cores if it is large
+        backend.apply_encryption_status(display_reencryption_progress, workers=min(4, os.cpu_count() or 1))
+        subheading_label.configure(text="Starting up your application.")
+        # Carry on with any key rotation in the background
+        backend.resume_key_rotation()
+
         # Create all frames in their default state
         self.frames = {"WelcomeFrame": WelcomeFrame(self),
                        "LoginFrame": LoginFrame(self),
@@ -237,7 +250,7 @@ class RegisterFrame(cWidget.ParentFrame):
                 matched_accounts = crud.search_table("ecommerce",
                                                      "Customer",
                                                      ["*"],
-                                                     f"username = '{backend.encrypt('username', entry_values['username'])}'")
+                                                     {"username": entry_values['username']})
                 mbox.showinfo("Success!", "Account created successfully!")
                 self.app.set_current_user(users.Customer(matched_accounts[0]))
                 self.app.load_frame("BrowsingFrame")
@@ -684,7 +697,7 @@ class BrowsingFrame(cWidget.ParentFrame):
                                                 [["supplier",
                                                  "supplier_id"]],
                                                 field_names,
-                                                "")
+                                                {})
         # If a search was entered into the search bar
         if self.searchbar.get_current_search() != "":
             # Only continue with products that match the search criteria
@@ -1458,7 +1471,7 @@ class CheckoutFrame(cWidget.ParentFrame):
         card_search = crud.search_table("ecommerce",
                                         "Payment_Card",
                                         ["*"],
-                                        f"customer_id = '{self.current_user.get_personal_id()}'")
+                                        {"customer_id": self.current_user.get_personal_id()})
         # Get existing cards
         self.matched_cards = {f"ends in {card.get('card_number')[-4:]}": card for card in card_search}
         print(self.matched_cards)
@@ -1514,6 +1527,8 @@ class ConfirmationFrame(cWidget.ParentFrame):
                                         text="",
                                         fg_color=colours.get_primary_colour())
         self.email_text.pack()
+        self.receipt_job_id = None
+        self.receipt_status_loop = None
 
         paragraph_text = cWidget.Label(content_frame,
                                        text="You can check the status of any orders in the 'My orders' section of your profile.",
@@ -1527,7 +1542,7 @@ class ConfirmationFrame(cWidget.ParentFrame):
                                            command=lambda: self.app.load_frame("BrowsingFrame"))
         home_button.pack(pady=30)
 
-    def refresh(self, order_id: int, email_was_successful: bool = False):
+    def refresh(self, order_id: int, receipt_job_id: int = None):
         """
         Updates the confirmation screen for the order most recently processes
 
@@ -1536,12 +1551,30 @@ class ConfirmationFrame(cWidget.ParentFrame):
         order_id : int
             The ID of the order just processed
 
-        email_was_successful : bool
-            Whether the order receipt was sent via email, either True if sent or False if not
+        receipt_job_id : int
+            The ID of the job that emails the order receipt
         """
         self.order_id_text.configure(text=f"Your order ID: {order_id}")
-        if email_was_successful:
+        self.receipt_job_id = receipt_job_id
+        self.update_receipt_status()
+
+    def update_receipt_status(self):
+        """
+        Show whether the order receipt has been emailed yet, checking again every second until it is sent or fails
+        """
+        if self.receipt_status_loop is not None:
+            self.after_cancel(self.receipt_status_loop)
+            self.receipt_status_loop = None
+        job = backend.get_job_queue().get_status(self.receipt_job_id) if self.receipt_job_id is not None else None
+        if job is None:
+            self.email_text.configure(text="")
+        elif job.get("status") == "Done":
             self.email_text.configure(text="An order confirmation has been sent to your email!")
+        elif job.get("status") == "Failed":
+            self.email_text.configure(text="We could not email your order confirmation.")
+        else:
+            self.email_text.configure(text="Your order confirmation is on its way to your email.")
+            self.receipt_status_loop = self.after(1000, self.update_receipt_status)
 
 
 class MyProfileFrame(cWidget.ParentFrame):
@@ -1606,7 +1639,7 @@ class MyProfileFrame(cWidget.ParentFrame):
         current_details = crud.search_table("ecommerce",
                                             "Customer",
                                             ["*"],
-                                            f"customer_id = {self.app.get_current_user().get_personal_id()}")[0]
+                                            {"customer_id": self.app.get_current_user().get_personal_id()})[0]
         field_headings = crud.get_table_headings("ecommerce", "Customer")[1:]
         self.entry_widgets = {}
 
@@ -1637,7 +1670,7 @@ class MyProfileFrame(cWidget.ParentFrame):
         current_details = crud.search_table("ecommerce",
                                             "Customer",
                                             ["*"],
-                                            f"customer_id = {self.app.get_current_user().get_personal_id()}")[0]
+                                            {"customer_id": self.app.get_current_user().get_personal_id()})[0]
         proposed_update_data = {}
         input_validities = []
         for field_name, entry_widget in self.entry_widgets.items():
@@ -1657,7 +1690,7 @@ class MyProfileFrame(cWidget.ParentFrame):
                 crud.update_record("ecommerce",
                                    "Customer",
                                    proposed_update_data,
-                                   f"customer_id = {customer_id}")
+                                   {"customer_id": customer_id})
                 customer.refresh_details()
                 self.refresh()
                 mbox.showinfo("Success!", "Details successfully updated!")
@@ -1680,37 +1713,8 @@ class MyProfileFrame(cWidget.ParentFrame):
 DETAILS, CARDS, ORDERS and RATINGS.\nAre you sure you want to continue?""")
         if delete_confirmed:
             customer = self.app.get_current_user()
-            customer_id = customer.get_personal_id()
-            # For all pending orders deleted, refund the stock
-            orders_pending = crud.search_table("ecommerce",
-                                               "Orders",
-                                               ["*"],
-                                               f"customer_id = '{customer_id}' AND delivery_status = 'Pending'")
-            products_per_order = []
-            for order in orders_pending:
-                products_bought = crud.search_table("ecommerce",
-                                                    "Order_Product",
-                                                    ["*"],
-                                                    f"order_id = '{order.get('order_id')}'")
-                products_per_order.append(products_bought)
-                for product in products_bought:
-                    backend.decrease_stock_by(product.get("product_id"), -(product.get("quantity")))
-
-            ratings_to_delete = crud.search_table("ecommerce", "Ratings", "*", f"customer_id = '{customer_id}'")
-
-            # Delete record and all linked records
-            crud.delete_record("ecommerce",
-                               "Customer",
-                               f"customer_id = {customer_id}")
-
-            # For all ratings deleted, update average rating
-            for rating in ratings_to_delete:
-                backend.update_product_rating(rating.get("product_id"))
-
-            # For all pending orders deleted, decrease the total sold
-            for products_bought in products_per_order:
-                for product in products_bought:
-                    backend.update_total_sold(product.get("product_id"))
+            # Delete record and all linked records, refunding the stock of pending orders
+            backend.delete_with_cascade("Customer", customer.get_personal_id())
             # Returns to the home screen
             self.app.logout()
 
@@ -1817,7 +1821,7 @@ class MyCardsFrame(cWidget.ParentFrame):
         all_cards = crud.search_table("ecommerce",
                                       "Payment_Card",
                                       ["*"],
-                                      f"customer_id = '{self.app.get_current_user().get_personal_id()}'")
+                                      {"customer_id": self.app.get_current_user().get_personal_id()})
         self.dropdown_values = {card.get("card_number"): card for card in all_cards}
         # If cards exist
         if self.dropdown_values:
@@ -1950,11 +1954,10 @@ class MyCardsFrame(cWidget.ParentFrame):
             self.refresh()
         else:
             if False not in input_validities:
-                search_criteria = backend.encrypt("card_number", card_to_update.get('card_number'))
                 crud.update_record("ecommerce",
                                    "Payment_Card",
                                    proposed_update_data,
-                                   f"card_number = '{search_criteria}'")
+                                   {"card_number": card_to_update.get('card_number')})
                 self.refresh()
                 mbox.showinfo("Success!", "Card successfully updated!")
             else:
@@ -1976,28 +1979,8 @@ class MyCardsFrame(cWidget.ParentFrame):
 TO THAT CARD.\nAre you sure you want to continue?""")
         if delete_confirmed:
             card_to_delete = self.dropdown_values.get(self.card_dropdown.get())
-            delete_id = card_to_delete.get("payment_card_id")
-            # For all pending orders deleted, refund the stock
-            orders_pending = crud.search_table("ecommerce",
-                                               "Orders",
-                                               ["*"],
-                                               f"payment_card_id = '{delete_id}' AND delivery_status = 'Pending'")
-            products_per_order = []
-            for order in orders_pending:
-                products_bought = crud.search_table("ecommerce",
-                                                    "Order_Product",
-                                                    ["*"],
-                                                    f"order_id = '{order.get('order_id')}'")
-                products_per_order.append(products_bought)
-                for product in products_bought:
-                    backend.decrease_stock_by(product.get("product_id"), -(product.get("quantity")))
-            crud.delete_record("ecommerce",
-                               "Payment_Card",
-                               f"payment_card_id = '{delete_id}'")
-            # For all pending orders deleted, decrease the total sold
-            for products_bought in products_per_order:
-                for product in products_bought:
-                    backend.update_total_sold(product.get("product_id"))
+            # Delete the card and its orders, refunding the stock of pending orders
+            backend.delete_with_cascade("Payment_Card", card_to_delete.get("payment_card_id"))
             self.switch_to_existing()
             mbox.showinfo("Success!", "Card successfully deleted!")
             
@@ -2066,7 +2049,7 @@ class MyOrdersFrame(cWidget.ParentFrame):
                                           "Orders",
                                           [["Payment_Card", "payment_card_id"]],
                                           ["*"],
-                                          f"Orders.customer_id = '{customer_id}'")
+                                          {"Orders.customer_id": customer_id})
         sorted_orders = sorted(orders, key=lambda sorted_order: sorted_order["date"], reverse=True)
         # Lifted from GeekForGeeks: https://www.geeksforgeeks.org/break-list-chunks-size-n-python/
         n = 2
@@ -2147,7 +2130,7 @@ class MyOrdersFrame(cWidget.ParentFrame):
                                                        "Order_Product",
                                                        [["Product", "product_id"]],
                                                        ["*"],
-                                                       f"order_id = '{order_id}'")
+                                                       {"order_id": order_id})
 
             # If there are two or more images
             if len(products_bought) != 1:
@@ -2296,14 +2279,14 @@ class PastOrderFrame(cWidget.ParentFrame):
             The ID of the order
         """
         self.entry_widgets = {}
-        order = crud.search_table("ecommerce", "Orders", ["*"], f"order_id = '{order_id}'")[0]
+        order = crud.search_table("ecommerce", "Orders", ["*"], {"order_id": order_id})[0]
 
         # Refresh basket
         products_bought = crud.search_joined_table("ecommerce",
                                                    "Order_Product",
                                                    [["Product", "product_id"]],
                                                    ["*"],
-                                                   f"order_id = {order_id}")
+                                                   {"order_id": order_id})
         self.basket_frame.refresh(overwrite_with=products_bought)
 
         # Refresh order information
@@ -2338,7 +2321,7 @@ class PastOrderFrame(cWidget.ParentFrame):
         all_cards = crud.search_table("ecommerce",
                                       "Payment_Card",
                                       ["*"],
-                                      f"customer_id = '{self.app.get_current_user().get_personal_id()}'")
+                                      {"customer_id": self.app.get_current_user().get_personal_id()})
 
         # Place widgets for fields that may or may not be amendable depending on the delivery status
         if order.get("delivery_status") == "Pending":
@@ -2476,7 +2459,7 @@ class PastOrderFrame(cWidget.ParentFrame):
                 crud.update_record("ecommerce",
                                    "Orders",
                                    proposed_update_data,
-                                   f"order_id = '{order.get('order_id')}'")
+                                   {"order_id": order.get('order_id')})
                 self.refresh(order.get("order_id"))
                 mbox.showinfo("Success!", "Order successfully updated!")
             else:
@@ -2495,18 +2478,8 @@ class PastOrderFrame(cWidget.ParentFrame):
         delete_confirmed = mbox.askyesnocancel("Warning!", """This action is PERMANENT and will DELETE THIS ORDER.
         \nAre you sure you want to continue?""")
         if delete_confirmed:
-            delete_id = order.get("order_id")
-            products_bought = crud.search_table("ecommerce",
-                                                "Order_Product",
-                                                ["*"],
-                                                f"order_id = '{delete_id}'")
-            crud.delete_record("ecommerce",
-                               "Orders",
-                               f"order_id = '{delete_id}'")
-            # Update stock and total sold
-            for product in products_bought:
-                backend.update_total_sold(product.get("product_id"))
-                backend.decrease_stock_by(product.get("product_id"), -int(product.get("quantity")))
+            # Refund the stock (the total sold is decreased by the Order_Product triggers)
+            backend.delete_with_cascade("Orders", order.get("order_id"))
             self.app.load_frame("MyOrdersFrame")
             mbox.showinfo("Success!", "Order successfully deleted!")
 
@@ -2628,10 +2601,22 @@ class ProcessingOrderFrame(cWidget.ParentFrame):
             Completes processing for an order
             """
             # Process order
-            order_id, was_email_sent = backend.process_order(self.app.get_current_user(), card_info, new_card_created, delivery_info)
+            try:
+                order_id, receipt_job_id = backend.process_order(self.app.get_current_user(), card_info, new_card_created, delivery_info)
+            except backend.InsufficientStockError as error:
+                crud.close_thread_connections()
+                self.progress_bar.reset()
+                # Return to the basket with the quantities that are still available
+                changed_products = self.app.get_current_user().get_basket().apply_stock_shortfalls(error.shortfalls)
+                self.app.load_frame("BasketFrame")
+                mbox.showwarning("Warning!", "Sorry, some items sold out whilst you were checking out. "
+                                             f"Your basket has been updated for: {', '.join(changed_products)}")
+                return
+            # Release this thread's pooled database connection
+            crud.close_thread_connections()
             # Stop progress bar and display confirmation
             self.progress_bar.reset()
-            self.app.load_frame("ConfirmationFrame", order_id=order_id, email_was_successful=was_email_sent)
+            self.app.load_frame("ConfirmationFrame", order_id=order_id, receipt_job_id=receipt_job_id)
 
         self.progress_bar.start(interval=10)
 
@@ -2662,6 +2647,8 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
 
         self.treeview = None
         self.table_name = None
+        self.key_rotation_label = None
+        self.key_rotation_loop = None
 
         title_frame = cWidget.Frame(self)
         title_frame.grid(row=0, column=0, sticky="W")
@@ -2853,10 +2840,10 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
         if self.table_name == "Product" or self.table_name == "Staff" or self.table_name == "Orders":
             # Set up dropdown menu to display
             if self.table_name == "Product":
-                all_records = crud.search_table("ecommerce",
-                                                "Supplier",
-                                                ["*"],
-                                                "")
+                all_records = crud.iter_table("ecommerce",
+                                              "Supplier",
+                                              ["*"],
+                                              {})
                 current_suppliers = ["Not applied"] + sorted({str(record.get("supplier_id")) for record in all_records})
                 dropdown_fields = {"category": ["Not applied", "Rackets", "Balls", "Clothing", "Equipment"],
                                    "supplier_id": current_suppliers}
@@ -2901,6 +2888,10 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
         """
         for widget in self.reports_frame.winfo_children():
             widget.destroy()
+        if self.key_rotation_loop is not None:
+            self.after_cancel(self.key_rotation_loop)
+            self.key_rotation_loop = None
+        self.key_rotation_label = None
         reports_heading = cWidget.Label(self.reports_frame,
                                         text="Reports",
                                         font=("Poppins Regular", 24))
@@ -2935,15 +2926,62 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
                                                    image_height=20)
                 email_button.grid(row=count+1, column=2, sticky="E")
 
+        # Management staff can rotate the encryption key from the staff table
+        if self.table_name == "Staff" and self.app.get_current_user().get_access_level() == "Management":
+            self.key_rotation_label = cWidget.Label(self.reports_frame,
+                                                    text="Encryption key",
+                                                    font=("Poppins Regular", 14))
+            self.key_rotation_label.grid(row=1, column=0, sticky="W")
+            rotate_button = cWidget.FilledButton(self.reports_frame,
+                                                 height=20,
+                                                 command=lambda: self.rotate_key(),
+                                                 text="Rotate",
+                                                 font=("Inter Regular", 14),
+                                                 bg_color=colours.get_bg_colour())
+            rotate_button.grid(row=1, column=1, columnspan=2, sticky="E")
+            self.update_key_rotation_progress()
+
+    def rotate_key(self):
+        """
+        Ask for a new encryption key and start re-encrypting the database with it in the background
+        """
+        new_key = simpledialog.askstring("Rotate encryption key", "Enter the new encryption key:", show="*", parent=self)
+        if new_key is None:
+            return
+        try:
+            backend.start_key_rotation(new_key)
+        except ValueError as error:
+            mbox.showerror("Error!", str(error))
+        else:
+            self.update_key_rotation_progress()
+
+    def update_key_rotation_progress(self):
+        """
+        Show how far the key rotation has got, checking again every second until it finishes or stops
+        """
+        if self.key_rotation_loop is not None:
+            self.after_cancel(self.key_rotation_loop)
+            self.key_rotation_loop = None
+        progress = backend.get_key_rotation_progress()
+        if progress is None:
+            self.key_rotation_label.configure(text="Encryption key")
+        elif not backend.is_key_rotating():
+            # The rotation failed and will carry on when the application next starts
+            self.key_rotation_label.configure(text="Key rotation paused until restart")
+        else:
+            percentage = min(100, round(progress.get("rows_done") / max(progress.get("total_rows"), 1) * 100))
+            self.key_rotation_label.configure(text=f"Rotating key: {percentage}%")
+            self.key_rotation_loop = self.after(1000, self.update_key_rotation_progress)
+
     def reset_treeview(self):
         """
         Reset the treeview to show all records for an entity
         """
         # Populate the treeview with all entity records
-        self.treeview.populate_tree(crud.search_table("ecommerce",
-                                    self.table_name,
-                                    ["*"],
-                                    ""))
+        self.treeview.populate_tree(crud.iter_table("ecommerce",
+                                                    self.table_name,
+                                                    ["*"],
+                                                    {}))
 
     def delete_selected(self):
         """
@@ -2965,85 +3003,15 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
                 id_field_name = crud.get_table_headings("ecommerce",
                                                         self.table_name)[0]
 
-                # If a customer is being deleted
-                if id_field_name == "customer_id":
-                    # For all pending orders deleted, refund the stock
-                    orders_pending = crud.search_table("ecommerce",
-                                                       "Orders",
-                                                       ["*"],
-                                                       f"customer_id = '{id_value}' AND delivery_status = 'Pending'")
-                    products_per_order = []
-                    for order in orders_pending:
-                        products_bought = crud.search_table("ecommerce",
-                                                            "Order_Product",
-                                                            ["*"],
-                                                            f"order_id = '{order.get('order_id')}'")
-                        products_per_order.append(products_bought)
-                        for product in products_bought:
-                            backend.decrease_stock_by(product.get("product_id"), -(product.get("quantity")))
-
-                    ratings_to_delete = crud.search_table("ecommerce", "Ratings", "*", f"customer_id = '{id_value}'")
-
-                    crud.delete_record("ecommerce",
-                                       self.table_name,
-                                       f"{id_field_name} = '{id_value}'")
-
-                    # Update product ratings for every product the user rated
-                    for rating in ratings_to_delete:
-                        backend.update_product_rating(rating.get("product_id"))
-
-                    # For all pending orders deleted, decrease the total sold
-                    for products_bought in products_per_order:
-                        for product in products_bought:
-                            backend.update_total_sold(product.get("product_id"))
-
-                # If an order or payment card is being deleted
-                elif id_field_name == "order_id" or id_field_name == "payment_card_id":
-                    if id_field_name == "order_id":
-                        # For all pending orders deleted, refund the stock
-                        orders_pending = crud.search_table("ecommerce",
-                                                           "Orders",
-                                                           ["*"],
-                                                           f"order_id = '{id_value}' AND delivery_status = 'Pending'")
-                    else:
-                        orders_pending = crud.search_table("ecommerce",
-                                                           "Orders",
-                                                           ["*"],
-                                                           f"payment_card_id = '{id_value}' AND delivery_status = 'Pending'")
-                    products_per_order = []
-                    for order in orders_pending:
-                        products_bought = crud.search_table("ecommerce",
-                                                            "Order_Product",
-                                                            ["*"],
-                                                            f"order_id = '{order.get('order_id')}'")
-                        products_per_order.append(products_bought)
-                        for product in products_bought:
-                            backend.decrease_stock_by(product.get("product_id"), -(product.get("quantity")))
-
-                    crud.delete_record("ecommerce",
-                                       self.table_name,
-                                       f"{id_field_name} = '{id_value}'")
-
-                    # For all pending orders deleted, decrease the total sold
-                    for products_bought in products_per_order:
-                        for product in products_bought:
-                            backend.update_total_sold(product.get("product_id"))
-
-                # If a rating is being deleted
-                elif id_field_name == "rating_id":
-                    # Update the product that was rated
-                    rating_to_delete = crud.search_table("ecommerce", "Ratings", "*", f"rating_id = '{id_value}'")[0]
+                # If a customer, payment card or order is being deleted, refund the stock of its pending orders
+                if self.table_name in backend.cascade_delete_fields:
+                    backend.delete_with_cascade(self.table_name, id_value)
 
-                    crud.delete_record("ecommerce",
-                                       self.table_name,
-                                       f"{id_field_name} = '{id_value}'")
-
-                    if rating_to_delete:
-                        backend.update_product_rating(rating_to_delete.get("product_id"))
+                # Any other record i.e. a rating, whose product's average rating is updated by the Ratings triggers
                 else:
                     crud.delete_record("ecommerce",
                                        self.table_name,
-                                       f"{id_field_name} = '{id_value}'")
+                                       {id_field_name: id_value})
                 self.treeview.delete_selected_record()
 
     def perform_action(self):
@@ -3060,13 +3028,13 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
         else:
             if self.current_mode == "Search":
                 # Search where field_name = value on fields that the user entered input for
-                search_parameters = [f"{field_name} = '{backend.encrypt(field_name, value)}'"
-                                     for count, (field_name, value) in enumerate(user_entry.items())
-                                     if value not in ["", "Not applied"]]
+                search_parameters = {field_name: value
+                                     for field_name, value in user_entry.items()
+                                     if value not in ["", "Not applied"]}
                 matched_records = crud.search_table("ecommerce",
                                                     self.table_name,
                                                     ["*"],
-                                                    "AND ".join(search_parameters))
+                                                    search_parameters)
                 self.treeview.populate_tree(matched_records)
             else:
                 if self.current_mode == "Create":
@@ -3127,7 +3095,7 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
                                     crud.update_record("ecommerce",
                                                        self.table_name,
                                                        field_values,
-                                                       f"{record_id_name} = '{record_id}'")
+                                                       {record_id_name: record_id})
                                     self.reset_treeview()
                                     self.reset_entry_frame()
                                     mbox.showinfo("Success!", f"{self.table_name} record updated successfully!")
@@ -3153,10 +3121,10 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
             else:
                 order_id = self.treeview.get_selected_values()[0]
                 customer_id = self.treeview.get_selected_values()[-2]
-                customer = crud.search_record("ecommerce",
-                                              "Customer",
-                                              ["*"],
-                                              f"customer_id = {customer_id}")
+                customer = crud.search_table("ecommerce",
+                                             "Customer",
+                                             ["*"],
+                                             {"customer_id": customer_id})[0]
                 full_name = f"{customer.get('name')} {customer.get('surname')}"
                 # Open summary report manager
                 summary_report_manager = self.app.expand_summary_report_manager()
@@ -3216,10 +3184,11 @@ class DatabaseManagementFrame(cWidget.ParentFrame):
         columns = [backend.convert_field_name_style(field)[:-1] for field in crud.get_table_headings("ecommerce", table_name=self.table_name)]
         self.treeview = cWidget.Treeview(self, columns)
         self.treeview.grid(row=2, column=0, columnspan=2, padx=30, pady=10, sticky="NSEW")
-        all_records = crud.search_table("ecommerce",
-                                        self.table_name,
-                                        ["*"],
-                                        "")
+        # Stream the records into the treeview rather than loading the whole table first
+        all_records = crud.iter_table("ecommerce",
+                                      self.table_name,
+                                      ["*"],
+                                      {})
         self.treeview.populate_tree(all_records)
 
 
@@ -3375,6 +3344,8 @@ class SummaryReportController(ctk.CTkToplevel):
                     report_pdf = backend.create_comparison_report(product_one, product_two)
                     email_subject = "Your product comparison"
                     email_body = f"Hi {name}, here's that amazing product comparison you made!"
+                # Release this thread's pooled database connection
+                crud.close_thread_connections()
 
                 if self.mode != "email":
                     self.progress_bar.stop()
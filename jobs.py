@@ -0,0 +1,321 @@
+from concurrent.futures import CancelledError, Future
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+import crud_functionality as crud
+
+
+class JobQueue:
+    """
+    Data structure that runs slow work i.e. sending emails on a pool of worker threads, away from
+    the thread that requested it. Jobs are stored in the database's Jobs table so that they survive
+    the application closing, and a job that raises an exception is retried after a delay that
+    doubles with each attempt until it has been attempted max_attempts times.
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database that holds the Jobs table
+
+    worker_count : int
+        The number of worker threads.
+        Defaults to 2
+
+    max_attempts : int
+        The number of times a job is attempted before it is marked as failed.
+        Defaults to 5
+
+    base_delay : float
+        The number of seconds before the first retry, which doubles for every retry after.
+        Defaults to 2
+
+    poll_interval : float
+        The longest number of seconds an idle worker waits before checking for jobs again.
+        Defaults to 1
+    """
+    def __init__(self,
+                 database_name: str,
+                 worker_count: int = 2,
+                 max_attempts: int = 5,
+                 base_delay: float = 2,
+                 poll_interval: float = 1):
+        self.database_name = database_name
+        self.worker_count = worker_count
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.poll_interval = poll_interval
+        # Keys are job types and values are the functions that carry them out
+        self.handlers = {}
+        self.workers = []
+        # Results of jobs handed off to other threads, which are recorded by the workers as [ID, attempts, error]
+        self.finished = queue.Queue()
+        self.handed_off = set()
+        self.handed_off_condition = threading.Condition()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+
+    def register(self, job_type: str, handler):
+        """
+        Sets the function that carries out a type of job
+
+        Parameters
+        ----------
+        job_type : str
+            The name of the type of job
+
+        handler : function
+            Called with the job's payload as keyword arguments.
+            Should raise an exception if the job needs to be retried.
+            May instead return a concurrent.futures.Future for work it has handed off i.e. an email being sent,
+            so the worker can move on to the next job. The job then finishes when the future does
+        """
+        self.handlers[job_type] = handler
+
+    def enqueue(self, job_type: str, payload: dict):
+        """
+        Adds a job to the queue. When called inside a transaction, the job only runs if the transaction commits
+
+        Parameters
+        ----------
+        job_type : str
+            The name of the type of job
+
+        payload : dict
+            The arguments for the job's handler, which must be JSON serialisable
+
+        Returns
+        -------
+        int
+            The ID of the job
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"No handler is registered for {job_type} jobs")
+        conn, cur = crud.open_database(self.database_name)
+        cur.execute("""INSERT INTO Jobs (job_type, payload, status, attempts, run_at, last_error)
+                       VALUES (?, ?, 'Pending', 0, ?, NULL)""", [job_type, json.dumps(payload), time.time()])
+        job_id = cur.lastrowid
+        crud.commit_unless_in_transaction(self.database_name, conn)
+        self.wake_event.set()
+        return job_id
+
+    def get_status(self, job_id: int):
+        """
+        Gets the state of a job
+
+        Parameters
+        ----------
+        job_id : int
+            The ID of the job
+
+        Returns
+        -------
+        dict | None
+            "status" states either 'Pending', 'Running', 'Done' or 'Failed',
+            "attempts" the number of times it has been attempted and "last_error" why the last attempt failed.
+            None if the job does not exist
+        """
+        conn, cur = crud.open_database(self.database_name)
+        job = cur.execute("SELECT status, attempts, last_error FROM Jobs WHERE job_id = ?", [job_id]).fetchone()
+        if job is None:
+            return None
+        return {"status": job[0],
+                "attempts": job[1],
+                "last_error": job[2]}
+
+    def claim_job(self):
+        """
+        Marks the next job that is due as running, so that no other worker takes it
+
+        Returns
+        -------
+        list | None
+            The job's [ID, type, payload, attempts so far], or None if no job is due
+        """
+        conn, cur = crud.open_database(self.database_name)
+        while True:
+            job = cur.execute("""SELECT job_id, job_type, payload, attempts FROM Jobs
+                                 WHERE status = 'Pending' AND run_at <= ? ORDER BY run_at LIMIT 1""", [time.time()]).fetchone()
+            if job is None:
+                return None
+            try:
+                # Only one worker's update can succeed if several found the same job
+                cur.execute("UPDATE Jobs SET status = 'Running', attempts = attempts + 1 WHERE job_id = ? AND status = 'Pending'", [job[0]])
+                claimed = cur.rowcount == 1
+                conn.commit()
+            except sqlite3.Error:
+                crud.rollback_unless_in_transaction(self.database_name, conn)
+                raise
+            if claimed:
+                return [job[0], job[1], json.loads(job[2]), job[3] + 1]
+
+    def run_job(self, job_id: int, job_type: str, payload: dict, attempts: int):
+        """
+        Carries out a claimed job, queueing its result to be recorded by a worker
+
+        Parameters
+        ----------
+        job_id : int
+            The ID of the job
+
+        job_type : str
+            The name of the type of job
+
+        payload : dict
+            The arguments for the job's handler
+
+        attempts : int
+            The number of times the job has been attempted, including this one
+        """
+        try:
+            result = self.handlers[job_type](**payload)
+        except Exception as error:
+            self.finished.put([job_id, attempts, error])
+            return
+        if isinstance(result, Future):
+            with self.handed_off_condition:
+                self.handed_off.add(result)
+            result.add_done_callback(lambda future: self.hand_back(job_id, attempts, future))
+        else:
+            self.finished.put([job_id, attempts, None])
+
+    def hand_back(self, job_id: int, attempts: int, future: Future):
+        """
+        Queues the result of a job that was handed off to another thread, so that a worker records it
+        rather than the thread that completed the future
+
+        Parameters
+        ----------
+        job_id : int
+            The ID of the job
+
+        attempts : int
+            The number of times the job has been attempted, including this one
+
+        future : concurrent.futures.Future
+            The completed future returned by the job's handler
+        """
+        error = CancelledError() if future.cancelled() else future.exception()
+        self.finished.put([job_id, attempts, error])
+        with self.handed_off_condition:
+            self.handed_off.discard(future)
+            self.handed_off_condition.notify_all()
+        self.wake_event.set()
+
+    def finish_job(self, job_id: int, attempts: int, error: Exception = None):
+        """
+        Marks a job as done, or reschedules it with a longer delay if it failed
+
+        Parameters
+        ----------
+        job_id : int
+            The ID of the job
+
+        attempts : int
+            The number of times the job has been attempted, including this one
+
+        error : Exception
+            Why the job failed.
+            Defaults to None, which means the job succeeded
+        """
+        conn, cur = crud.open_database(self.database_name)
+        try:
+            if error is None:
+                cur.execute("UPDATE Jobs SET status = 'Done', last_error = NULL WHERE job_id = ?", [job_id])
+            elif attempts >= self.max_attempts:
+                cur.execute("UPDATE Jobs SET status = 'Failed', last_error = ? WHERE job_id = ?", [repr(error), job_id])
+            else:
+                retry_at = time.time() + self.base_delay * 2 ** (attempts - 1)
+                cur.execute("UPDATE Jobs SET status = 'Pending', run_at = ?, last_error = ? WHERE job_id = ?",
+                            [retry_at, repr(error), job_id])
+            crud.commit_unless_in_transaction(self.database_name, conn)
+        except sqlite3.Error:
+            crud.rollback_unless_in_transaction(self.database_name, conn)
+            raise
+
+    def finish_jobs(self):
+        """
+        Records the results of every job that has finished in one transaction. Results that cannot be recorded
+        i.e. because the database is locked are kept, so that they are recorded on a later call
+        """
+        job_results = []
+        while True:
+            try:
+                job_results.append(self.finished.get_nowait())
+            except queue.Empty:
+                break
+        if not job_results:
+            return
+        try:
+            with crud.transaction(self.database_name):
+                for job_result in job_results:
+                    self.finish_job(*job_result)
+        except Exception:
+            for job_result in job_results:
+                self.finished.put(job_result)
+            raise
+
+    def work(self):
+        """
+        Runs jobs as they become due until the queue is stopped. An error does not stop the worker,
+        which waits for the poll interval before trying again
+        """
+        try:
+            while not self.stop_event.is_set():
+                job = None
+                try:
+                    self.finish_jobs()
+                    job = self.claim_job()
+                    if job is None:
+                        self.wake_event.wait(self.poll_interval)
+                        self.wake_event.clear()
+                    else:
+                        self.run_job(*job)
+                except Exception as error:
+                    print(f"JOB QUEUE ERROR: {error!r}")
+                    if job is not None:
+                        # Returns the job to the queue with a longer delay once it can be recorded
+                        self.finished.put([job[0], job[3], error])
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            crud.close_thread_connections()
+
+    def start(self):
+        """
+        Starts the worker threads, first returning any jobs left running when the application last closed to the queue
+        """
+        if self.workers:
+            return
+        conn, cur = crud.open_database(self.database_name)
+        cur.execute("UPDATE Jobs SET status = 'Pending' WHERE status = 'Running'")
+        conn.commit()
+        self.stop_event.clear()
+        for _ in range(self.worker_count):
+            worker = threading.Thread(target=self.work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout: float = 5):
+        """
+        Stops the worker threads once they finish their current jobs, including those handed off to other threads,
+        and records their results. Jobs that are still unfinished are run again when the queue next starts
+
+        Parameters
+        ----------
+        timeout : float
+            The number of seconds to wait for each worker and for the handed off jobs.
+            Defaults to 5
+        """
+        self.stop_event.set()
+        self.wake_event.set()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+        with self.handed_off_condition:
+            self.handed_off_condition.wait_for(lambda: not self.handed_off, timeout)
+        try:
+            self.finish_jobs()
+        except Exception as error:
+            print(f"JOB QUEUE ERROR: {error!r}")
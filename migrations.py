@@ -0,0 +1,378 @@
+import sqlite3
+import sys
+
+import backend
+import crud_functionality as crud
+
+
+def get_stored_encryption(cur: sqlite3.Cursor,
+                          table_name: str):
+    """
+    Works out whether a table's fields are actually stored encrypted from the data itself, as the encryption status
+    file only states what was requested and is not applied until the application has started
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+
+    table_name : str
+        The name of the table
+
+    Returns
+    -------
+    list
+        [the last primary key of the records written by an interrupted re-encryption (0 if there are none),
+        whether those records are encrypted, whether the records after them are encrypted]
+    """
+    # Each row is (encrypting, table name, last primary key written)
+    progress = cur.execute("SELECT encrypting, table_name, last_id FROM Reencryption_Progress WHERE job_id = 1").fetchone()
+    if progress is not None:
+        encrypting, interrupted_table, last_id = bool(progress[0]), progress[1], progress[2]
+        # Tables are re-encrypted one after another, so earlier tables are finished and later ones not started
+        table_order = backend.encrypted_tables.index(table_name) - backend.encrypted_tables.index(interrupted_table)
+        if table_order < 0:
+            return [0, encrypting, encrypting]
+        elif table_order > 0:
+            return [0, not encrypting, not encrypting]
+        return [last_id, encrypting, not encrypting]
+
+    # As in apply_encryption_status, the admin account's username "management" starts with "^" once encrypted
+    admin_account = cur.execute("SELECT username FROM Staff WHERE staff_id = 1").fetchone()
+    if admin_account is None:
+        encrypted = backend.get_should_encrypt()
+    else:
+        encrypted = admin_account[0][:1] in ["^", backend.keyring.version_marker]
+    return [0, encrypted, encrypted]
+
+
+def migration_1(cur: sqlite3.Cursor):
+    """
+    Adds secondary indexes for the fields that are most frequently filtered on
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON Orders(customer_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_date ON Orders(date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_product_order_id ON Order_Product(order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_product_product_id ON Order_Product(product_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ratings_product_id ON Ratings(product_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_username ON Customer(username)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payment_card_customer_id ON Payment_Card(customer_id)")
+
+
+def migration_2(cur: sqlite3.Cursor):
+    """
+    Adds the table that records how far a re-encryption of the database has got, so that it can resume
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    cur.execute("""CREATE TABLE IF NOT EXISTS Reencryption_Progress(job_id INTEGER PRIMARY KEY,
+                 encrypting INTEGER NOT NULL,
+                 table_name TEXT NOT NULL,
+                 last_id INTEGER NOT NULL)""")
+
+
+def migration_3(cur: sqlite3.Cursor):
+    """
+    Adds indexed blind index columns for the encrypted fields that are looked up by equality,
+    filling them in for existing records
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    blind_indexed_tables = {"Customer": ["username", "email_address"],
+                            "Staff": ["username", "email_address"],
+                            "Payment_Card": ["card_number"]}
+    for table_name, field_names in blind_indexed_tables.items():
+        # Each row is (cid, name, type, notnull, default value, pk)
+        primary_key = [column[1] for column in cur.execute(f"PRAGMA table_info({table_name})").fetchall() if column[5]][0]
+        # The encryption status may have been changed without the database being re-encrypted yet
+        last_id, encrypted_up_to_last_id, encrypted_after_last_id = get_stored_encryption(cur, table_name)
+        for field_name in field_names:
+            column_name = backend.get_blind_index_column(field_name)
+            cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} TEXT")
+            # Blind indexes are calculated from the decrypted values
+            blind_indexes = []
+            for value, record_id in cur.execute(f"SELECT {field_name}, {primary_key} FROM {table_name}").fetchall():
+                encrypted = encrypted_up_to_last_id if record_id <= last_id else encrypted_after_last_id
+                if encrypted and value is not None:
+                    value = backend.keyring.decrypt(str(value))
+                blind_indexes.append([backend.get_blind_index(value), record_id])
+            cur.executemany(f"UPDATE {table_name} SET {column_name} = ? WHERE {primary_key} = ?", blind_indexes)
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name.lower()}_{column_name} ON {table_name}({column_name})")
+
+
+def migration_4(cur: sqlite3.Cursor):
+    """
+    Adds the table that records how far a key rotation has got, so that it can resume
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    cur.execute("""CREATE TABLE IF NOT EXISTS Key_Rotation_Progress(job_id INTEGER PRIMARY KEY,
+                 to_version INTEGER NOT NULL,
+                 table_name TEXT NOT NULL,
+                 last_id INTEGER NOT NULL,
+                 rows_done INTEGER NOT NULL,
+                 total_rows INTEGER NOT NULL)""")
+
+
+def migration_5(cur: sqlite3.Cursor):
+    """
+    Adds the table that holds background jobs i.e. emailing order receipts
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    cur.execute("""CREATE TABLE IF NOT EXISTS Jobs(job_id INTEGER PRIMARY KEY,
+                 job_type TEXT NOT NULL,
+                 payload TEXT NOT NULL,
+                 status TEXT NOT NULL,
+                 attempts INTEGER NOT NULL,
+                 run_at REAL NOT NULL,
+                 last_error TEXT)""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON Jobs(status, run_at)")
+
+
+def migration_6(cur: sqlite3.Cursor):
+    """
+    Adds triggers that keep each product's total sold up to date as order lines are added, changed and deleted,
+    recalculating every product's total sold once
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS trg_order_product_insert_total_sold AFTER INSERT ON Order_Product
+                 BEGIN
+                     UPDATE Product SET total_sold = total_sold + NEW.quantity WHERE product_id = NEW.product_id;
+                 END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS trg_order_product_delete_total_sold AFTER DELETE ON Order_Product
+                 BEGIN
+                     UPDATE Product SET total_sold = total_sold - OLD.quantity WHERE product_id = OLD.product_id;
+                 END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS trg_order_product_update_total_sold AFTER UPDATE OF quantity, product_id ON Order_Product
+                 BEGIN
+                     UPDATE Product SET total_sold = total_sold - OLD.quantity WHERE product_id = OLD.product_id;
+                     UPDATE Product SET total_sold = total_sold + NEW.quantity WHERE product_id = NEW.product_id;
+                 END""")
+    cur.execute("""UPDATE Product SET total_sold = (SELECT TOTAL(quantity) FROM Order_Product
+                                                    WHERE Order_Product.product_id = Product.product_id)""")
+
+
+def migration_7(cur: sqlite3.Cursor):
+    """
+    Adds each product's rating count and rating sum, kept up to date with its average rating by triggers
+    as ratings are added, changed and deleted, calculating them once for existing ratings
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    cur.execute("ALTER TABLE Product ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE Product ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0")
+    # The average is recalculated from the running totals after they change
+    average_rating = "CASE WHEN rating_count = 0 THEN 0 ELSE ROUND(CAST(rating_sum AS REAL) / rating_count, 1) END"
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_ratings_insert_rating_totals AFTER INSERT ON Ratings
+                  BEGIN
+                      UPDATE Product SET rating_count = rating_count + 1, rating_sum = rating_sum + NEW.score
+                      WHERE product_id = NEW.product_id;
+                      UPDATE Product SET average_rating = {average_rating} WHERE product_id = NEW.product_id;
+                  END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_ratings_delete_rating_totals AFTER DELETE ON Ratings
+                  BEGIN
+                      UPDATE Product SET rating_count = rating_count - 1, rating_sum = rating_sum - OLD.score
+                      WHERE product_id = OLD.product_id;
+                      UPDATE Product SET average_rating = {average_rating} WHERE product_id = OLD.product_id;
+                  END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_ratings_update_rating_totals AFTER UPDATE OF score, product_id ON Ratings
+                  BEGIN
+                      UPDATE Product SET rating_count = rating_count - 1, rating_sum = rating_sum - OLD.score
+                      WHERE product_id = OLD.product_id;
+                      UPDATE Product SET rating_count = rating_count + 1, rating_sum = rating_sum + NEW.score
+                      WHERE product_id = NEW.product_id;
+                      UPDATE Product SET average_rating = {average_rating} WHERE product_id IN (OLD.product_id, NEW.product_id);
+                  END""")
+    cur.execute("""UPDATE Product SET rating_count = (SELECT COUNT(*) FROM Ratings WHERE Ratings.product_id = Product.product_id),
+                                      rating_sum = (SELECT TOTAL(score) FROM Ratings WHERE Ratings.product_id = Product.product_id)""")
+    cur.execute(f"UPDATE Product SET average_rating = {average_rating}")
+
+
+def migration_8(cur: sqlite3.Cursor):
+    """
+    Decrypts staff IDs and weekly hours that were written encrypted whilst a missing comma left them out of
+    the plaintext fields. Both are INTEGER columns, which store plaintext numbers as integers, so any value
+    stored as text is ciphertext (SQLite never lets staff_id, the primary key, hold text, but it is checked all the same)
+
+    Parameters
+    ----------
+    cur : sqlite3.Cursor
+        The cursor used to apply the migration
+    """
+    for field_name in ["staff_id", "weekly_hours"]:
+        rows = cur.execute(f"SELECT {field_name}, rowid FROM Staff WHERE typeof({field_name}) = 'text'").fetchall()
+        # The column's integer affinity converts the decrypted numbers back into integers
+        cur.executemany(f"UPDATE Staff SET {field_name} = ? WHERE rowid = ?",
+                        [[backend.keyring.decrypt(value), row_id] for value, row_id in rows])
+
+
+# Migrations in the order they must be applied.
+# Each is written as [version number, description, migration function]
+all_migrations = [[1, "Add indexes for frequently filtered fields", migration_1],
+                  [2, "Add re-encryption progress table", migration_2],
+                  [3, "Add blind indexes for usernames, email addresses and card numbers", migration_3],
+                  [4, "Add key rotation progress table", migration_4],
+                  [5, "Add background jobs table", migration_5],
+                  [6, "Add triggers that maintain each product's total sold", migration_6],
+                  [7, "Add rating counts and sums maintained by triggers", migration_7],
+                  [8, "Decrypt staff IDs and weekly hours stored encrypted", migration_8]]
+
+# Queries run on the hot paths of the application, written as [name, SQL, example values]
+hot_queries = [["Orders by customer", "SELECT * FROM Orders WHERE customer_id = ?", [1]],
+               ["Orders by date range", "SELECT * FROM Orders WHERE date >= ? AND date <= ?", ["2023-01-01", "2023-12-31"]],
+               ["Order lines by order", "SELECT * FROM Order_Product WHERE order_id = ?", [1]],
+               ["Order lines by product", "SELECT * FROM Order_Product WHERE product_id = ?", [1]],
+               ["Ratings by product", "SELECT score FROM Ratings WHERE product_id = ?", [1]],
+               ["Customer by username", "SELECT * FROM Customer WHERE username = ? AND password = ?", ["username", "password"]],
+               ["Cards by customer", "SELECT * FROM Payment_Card WHERE customer_id = ?", [1]]]
+
+
+def get_schema_version(database_name: str):
+    """
+    Gets the version of the schema that the database is currently on
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    Returns
+    -------
+    int
+        The number of the last migration applied, or 0 if none have been applied
+    """
+    conn, cur = crud.open_database(database_name)
+    return cur.execute("PRAGMA user_version").fetchone()[0]
+
+
+def get_pending_migrations(database_name: str):
+    """
+    Gets the migrations that have not yet been applied to the database
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    Returns
+    -------
+    list
+        The pending migrations in the order they must be applied
+    """
+    current_version = get_schema_version(database_name)
+    return [migration for migration in all_migrations if migration[0] > current_version]
+
+
+def explain_hot_queries(database_name: str):
+    """
+    Gets SQLite's query plan for each of the application's hot queries
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    Returns
+    -------
+    dict
+        Keys state the name of the query.
+        Values state the lines of its query plan i.e. "SCAN Orders" or "SEARCH Orders USING INDEX ..."
+    """
+    conn, cur = crud.open_database(database_name)
+    query_plans = {}
+    for query_name, query, example_values in hot_queries:
+        # Each row is (id, parent, unused, detail)
+        plan_rows = cur.execute(f"EXPLAIN QUERY PLAN {query}", example_values).fetchall()
+        query_plans[query_name] = [plan_row[3] for plan_row in plan_rows]
+    return query_plans
+
+
+def print_query_plans(query_plans: dict, heading: str):
+    """
+    Displays query plans in the console
+
+    Parameters
+    ----------
+    query_plans : dict
+        The query plans returned by explain_hot_queries
+
+    heading : str
+        The heading displayed above the plans
+    """
+    print(heading)
+    for query_name, plan_lines in query_plans.items():
+        print(f"    {query_name}: {'; '.join(plan_lines)}")
+
+
+def run_migrations(database_name: str,
+                   show_query_plans: bool = False):
+    """
+    Applies every pending migration to the database, recording the new schema version after each
+
+    Parameters
+    ----------
+    database_name : str
+        The name of the database
+
+    show_query_plans : bool
+        Whether the query plans of the hot queries should be displayed before and after migrating.
+        Defaults to False
+
+    Returns
+    -------
+    int
+        The schema version of the database after migrating
+    """
+    pending_migrations = get_pending_migrations(database_name)
+    if show_query_plans:
+        print_query_plans(explain_hot_queries(database_name), "QUERY PLANS BEFORE MIGRATING")
+
+    for version, description, migration in pending_migrations:
+        # Apply each migration and its version number atomically
+        with crud.transaction(database_name) as tx:
+            migration(tx.cursor)
+            tx.cursor.execute(f"PRAGMA user_version = {int(version)}")
+        print(f"MIGRATION {version} APPLIED: {description}")
+
+    if pending_migrations:
+        # Migrations may have altered tables
+        crud.invalidate_schema(database_name)
+    if show_query_plans:
+        print_query_plans(explain_hot_queries(database_name), "QUERY PLANS AFTER MIGRATING")
+    return get_schema_version(database_name)
+
+
+if __name__ == "__main__":
+    run_migrations("ecommerce", show_query_plans=True)
+    # Run with --repair-total-sold to correct any total sold that differs from its order lines
+    repair = "--repair-total-sold" in sys.argv
+    incorrect_totals = backend.verify_total_sold(repair=repair)
+    for product_id, [stored_total, actual_total] in incorrect_totals.items():
+        print(f"TOTAL SOLD {'REPAIRED' if repair else 'INCORRECT'}: product {product_id} had {stored_total}, should be {actual_total}")
+    if not incorrect_totals:
+        print("TOTAL SOLD VERIFIED: every product matches its order lines")
@@ -80,7 +80,7 @@ class Customer(User):
         account_details = crud.search_table("ecommerce",
                                             "Customer",
                                             ["*"],
-                                            f"customer_id = {self.personal_id}")[0]
+                                            {"customer_id": self.personal_id})[0]
         # Reset the stored details to the most up to date versions
         self.username = account_details.get("username")
         self.name = account_details.get("name")
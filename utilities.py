@@ -57,6 +57,34 @@ class Basket:
                 product["quantity"] = quantity
         self.update_subtotal()
 
+    def apply_stock_shortfalls(self, shortfalls: dict):
+        """
+        Reduces the quantities of products that no longer have enough stock, removing any that have sold out
+
+        Parameters
+        ----------
+        shortfalls : dict
+            Keys state the IDs of the products that are short.
+            Values state the stock that is available for each
+
+        Returns
+        -------
+        list
+            The names of the products that were changed
+        """
+        changed_products = []
+        for product in list(self.products):
+            available_stock = shortfalls.get(product.get("product_id"))
+            if available_stock is not None:
+                changed_products.append(product.get("name"))
+                product["current_stock"] = available_stock
+                if available_stock <= 0:
+                    self.products.remove(product)
+                else:
+                    product["quantity"] = min(product.get("quantity"), available_stock)
+        self.update_subtotal()
+        return changed_products
+
     def update_subtotal(self):
         """
         Updates the subtotal (and consequently total) of the basket
@@ -117,7 +117,7 @@ def fk_constraint_check(value_to_check: object,
     if crud.search_table("ecommerce",
                          search_table_name,
                          ["*"],
-                         f"{fk_field} = '{value_to_check}'"):
+                         {fk_field: value_to_check}):
         return True
     else:
         return False
@@ -511,7 +511,7 @@ def uniqueness_check(value_to_check: object,
     search_returns = crud.search_table(database_to_check,
                                        table_to_check,
                                        [f"{field_to_check}"],
-                                       f"{field_to_check} = '{value_to_check}'")
+                                       {field_to_check: value_to_check})
     # If the list returned is empty
     if not search_returns:
         return True